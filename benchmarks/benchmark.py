@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+"""
+Benchmarks of the Python side of pytesseract, with stub_tesseract.py in
+place of the tesseract executable, so the results only depend on the
+wrapper. The results are written as JSON, which --compare compares with the
+results of another commit:
+
+    python benchmarks/benchmark.py --output before.json
+    python benchmarks/benchmark.py --output after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+from timeit import Timer, default_timer
+
+from PIL import Image
+
+import stub_tesseract
+from pytesseract import pytesseract
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+STUB_TESSERACT = os.path.join(BENCHMARKS_DIR, 'stub_tesseract.py')
+IMAGE_SIZES = [(640, 480), (1700, 2200), (2480, 3508)]
+IMAGE_MODES = ['1', 'L', 'RGB', 'RGBA', 'P']
+ROW_COUNTS = [100, 1000, 10000]
+QUICK_IMAGE_SIZES = IMAGE_SIZES[:1]
+QUICK_ROW_COUNTS = ROW_COUNTS[:1]
+
+
+def measure(func, repeat, min_time):
+    """
+    Returns the timings of func (run as often as it takes min_time seconds
+    per repetition), in seconds per call.
+    """
+    timer = Timer(func, timer=default_timer)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2
+
+    timings = sorted(
+        elapsed / number for elapsed in timer.repeat(repeat, number)
+    )
+    return {
+        'number': number,
+        'repeat': repeat,
+        'min': timings[0],
+        'median': timings[len(timings) // 2],
+        'mean': sum(timings) / len(timings),
+        'ops_per_sec': 1 / timings[len(timings) // 2],
+    }
+
+
+def make_image(size, mode):
+    # a gradient, so that the encoders have some work to do
+    image = Image.linear_gradient('L').resize(size)
+    if mode == 'P':
+        return image.convert('RGB').convert('P', palette=Image.ADAPTIVE)
+    return image.convert(mode)
+
+
+def bench_prepare(size, mode):
+    image = make_image(size, mode)
+    return lambda: pytesseract.prepare(image)
+
+
+def bench_save(size, mode):
+    image = make_image(size, mode)
+
+    def save():
+        with pytesseract.save(image):
+            pass
+
+    return save
+
+
+def bench_run_tesseract(transport):
+    image = make_image((64, 64), 'L')
+    return lambda: pytesseract.run_and_get_output(
+        image, 'txt', transport=transport, cache=False,
+    )
+
+
+def bench_file_to_dict(rows):
+    tsv = stub_tesseract.to_tsv(1, rows)
+    return lambda: pytesseract.file_to_dict(tsv, '\t', -1)
+
+
+def bench_data(rows):
+    tsv = stub_tesseract.to_tsv(1, rows)
+    return lambda: pytesseract.Data(tsv)
+
+
+def bench_tsv_to_numpy(rows):
+    tsv = stub_tesseract.to_tsv(1, rows).encode('utf-8')
+    return lambda: pytesseract.tsv_to_numpy(tsv, '\t')
+
+
+def bench_osd_to_dict():
+    return lambda: pytesseract.osd_to_dict(stub_tesseract.OSD)
+
+
+def bench_get_pandas_output(rows):
+    image = make_image((64, 64), 'L')
+    os.environ['STUB_TESSERACT_WORDS'] = str(rows)
+    args = [image, 'tsv', None, '-c tessedit_create_tsv=1', 0, 0, True]
+    return lambda: pytesseract.get_pandas_output(args, cache=False)
+
+
+def get_benchmarks(quick=False):
+    """
+    Yields the name, parameters and setup function of each benchmark.
+    """
+    sizes = QUICK_IMAGE_SIZES if quick else IMAGE_SIZES
+    row_counts = QUICK_ROW_COUNTS if quick else ROW_COUNTS
+
+    for setup in bench_prepare, bench_save:
+        for width, height in sizes:
+            for mode in IMAGE_MODES:
+                params = {'size': '{}x{}'.format(width, height), 'mode': mode}
+                yield setup.__name__[6:], params, (
+                    lambda setup=setup, size=(width, height), mode=mode: (
+                        setup(size, mode)
+                    )
+                )
+
+    for transport in pytesseract.Transport.FILE, pytesseract.Transport.PIPE:
+        yield 'run_tesseract', {'transport': transport}, (
+            lambda transport=transport: bench_run_tesseract(transport)
+        )
+
+    yield 'osd_to_dict', {}, bench_osd_to_dict
+
+    for setup in (
+        bench_file_to_dict,
+        bench_data,
+        bench_tsv_to_numpy,
+        bench_get_pandas_output,
+    ):
+        for rows in row_counts:
+            yield setup.__name__[6:], {'rows': rows}, (
+                lambda setup=setup, rows=rows: setup(rows)
+            )
+
+
+def get_metadata():
+    try:
+        commit = (
+            subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'],
+                cwd=BENCHMARKS_DIR,
+                stderr=subprocess.STDOUT,
+            )
+            .decode('utf-8')
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'intermediate_format': pytesseract.intermediate_format,
+    }
+
+
+def run(names=None, quick=False, repeat=5, min_time=0.2):
+    results = []
+    for name, params, setup in get_benchmarks(quick):
+        if names and name not in names:
+            continue
+
+        result = {'name': name, 'params': params}
+        try:
+            result.update(measure(setup(), repeat, min_time))
+        except (pytesseract.PandasNotSupported, pytesseract.NumpyNotSupported):
+            result['skipped'] = 'requires pandas/numpy'
+        results.append(result)
+        sys.stderr.write(format_result(result) + '\n')
+
+    os.environ.pop('STUB_TESSERACT_WORDS', None)
+    return {'metadata': get_metadata(), 'results': results}
+
+
+def get_key(result):
+    return result['name'], json.dumps(result['params'], sort_keys=True)
+
+
+def format_result(result, baseline=None):
+    line = '{:<16} {:<36}'.format(
+        result['name'], json.dumps(result['params'], sort_keys=True),
+    )
+    if 'skipped' in result:
+        return line + ' skipped: ' + result['skipped']
+
+    line += ' {:>12.1f} us'.format(result['median'] * 1e6)
+    if baseline and 'median' in baseline:
+        line += ' {:>7.2f}x'.format(result['median'] / baseline['median'])
+    return line
+
+
+def compare(results, baseline_results):
+    """
+    Returns the lines of a comparison with the baseline results, with the
+    ratio of the median timings (> 1 means slower than the baseline).
+    """
+    baseline = {get_key(result): result for result in baseline_results}
+    return [
+        format_result(result, baseline.get(get_key(result)))
+        for result in results
+    ]
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument(
+        'names', nargs='*', help='benchmarks to run, all by default',
+    )
+    parser.add_argument('--output', help='JSON file for the results')
+    parser.add_argument('--compare', help='JSON file of baseline results')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.2)
+    parser.add_argument(
+        '--quick', action='store_true', help='only the smallest inputs',
+    )
+    args = parser.parse_args(args)
+
+    pytesseract.tesseract_cmd = STUB_TESSERACT
+    started = default_timer()
+    report = run(args.names, args.quick, args.repeat, args.min_time)
+    report['metadata']['duration'] = default_timer() - started
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        sys.stderr.write(
+            '\n'.join(compare(report['results'], baseline['results'])) + '\n',
+        )
+    return report
+
+
+if __name__ == '__main__':
+    main()
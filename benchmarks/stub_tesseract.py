@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+"""
+Stub of the tesseract executable for the benchmarks. It accepts the command
+line of tesseract, doesn't look at the image and writes canned txt, tsv,
+box, hocr, pdf or osd outputs. STUB_TESSERACT_WORDS (100 by default) and
+STUB_TESSERACT_PAGES (1) set the size of the outputs.
+"""
+import os
+import sys
+
+VERSION = 'tesseract 4.1.1-stub\n leptonica-1.79.0\n'
+WORDS_PER_LINE = 10
+OSD = (
+    'Page number: 0\n'
+    'Orientation in degrees: 0\n'
+    'Rotate: 0\n'
+    'Orientation confidence: 10.35\n'
+    'Script: Latin\n'
+    'Script confidence: 2.81\n'
+)
+
+
+def words(count):
+    return ['word{}'.format(index) for index in range(count)]
+
+
+def to_txt(pages, word_count):
+    lines = []
+    for _ in range(pages):
+        page = words(word_count)
+        while page:
+            lines.append(' '.join(page[:WORDS_PER_LINE]))
+            page = page[WORDS_PER_LINE:]
+        lines.append('\f')
+    return '\n'.join(lines)
+
+
+def to_tsv(pages, word_count):
+    rows = [
+        'level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\t'
+        'left\ttop\twidth\theight\tconf\ttext',
+    ]
+    row = '{}\t{}\t1\t1\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}'
+    for page_num in range(1, pages + 1):
+        rows.append(
+            '1\t{}\t0\t0\t0\t0\t0\t0\t2480\t3508\t-1\t'.format(page_num)
+        )
+        rows.append(
+            '2\t{}\t1\t0\t0\t0\t100\t100\t2280\t3308\t-1\t'.format(page_num)
+        )
+        rows.append(
+            '3\t{}\t1\t1\t0\t0\t100\t100\t2280\t3308\t-1\t'.format(page_num)
+        )
+        for index, word in enumerate(words(word_count)):
+            line_num, word_num = divmod(index, WORDS_PER_LINE)
+            top = 100 + 40 * line_num
+            if word_num == 0:
+                rows.append(
+                    row.format(
+                        4,
+                        page_num,
+                        line_num + 1,
+                        0,
+                        100,
+                        top,
+                        2280,
+                        32,
+                        -1,
+                        '',
+                    ),
+                )
+            rows.append(
+                row.format(
+                    5,
+                    page_num,
+                    line_num + 1,
+                    word_num + 1,
+                    100 + 220 * word_num,
+                    top,
+                    200,
+                    32,
+                    '{:.6f}'.format(90 + index % 10),
+                    word,
+                ),
+            )
+    return '\n'.join(rows) + '\n'
+
+
+def to_box(pages, word_count):
+    lines = []
+    for page in range(pages):
+        for index, word in enumerate(words(word_count)):
+            left = 100 + 20 * (index % 100)
+            for char in word:
+                lines.append(
+                    '{} {} 3400 {} 3432 {}'.format(
+                        char, left, left + 18, page
+                    ),
+                )
+                left += 20
+    return '\n'.join(lines) + '\n'
+
+
+def to_hocr(pages, word_count):
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<html xmlns="http://www.w3.org/1999/xhtml"><body>\n',
+    ]
+    for page in range(1, pages + 1):
+        parts.append(
+            "<div class='ocr_page' id='page_{0}' "
+            "title='bbox 0 0 2480 3508; ppageno {1}'>\n".format(
+                page, page - 1
+            ),
+        )
+        for index, word in enumerate(words(word_count)):
+            parts.append(
+                "<span class='ocrx_word' id='word_{0}_{1}' "
+                "title='bbox 100 100 300 132; x_wconf 95'>{2}</span>\n".format(
+                    page, index + 1, word,
+                ),
+            )
+        parts.append('</div>\n')
+    parts.append('</body></html>\n')
+    return ''.join(parts)
+
+
+def to_pdf(pages, word_count):
+    return '%PDF-1.5\n{}%%EOF\n'.format(to_txt(pages, word_count))
+
+
+def to_osd(pages, word_count):
+    return OSD
+
+
+RENDERERS = {
+    'box': to_box,
+    'hocr': to_hocr,
+    'osd': to_osd,
+    'pdf': to_pdf,
+    'tsv': to_tsv,
+    'txt': to_txt,
+}
+
+
+def get_extensions(args):
+    """
+    Returns the extensions of the outputs, which tesseract would write for
+    the options and config files of the command line.
+    """
+    psm, configs, variables = None, [], {}
+    args = iter(args)
+    for arg in args:
+        if arg in {'-l', '--oem', '--tessdata-dir', '--dpi'}:
+            next(args, None)
+        elif arg in {'--psm', '-psm'}:
+            psm = next(args, None)
+        elif arg == '-c':
+            name, _, value = next(args, '').partition('=')
+            variables[name] = value
+        else:
+            configs.append(arg)
+
+    if psm == '0':
+        return ['osd']
+
+    extensions = [
+        name for name in ('hocr', 'pdf', 'tsv', 'txt') if name in configs
+    ]
+    if variables.get('tessedit_create_tsv') == '1':
+        extensions.append('tsv')
+    if 'makebox' in configs:
+        extensions.append('box')
+    return extensions or ['txt']
+
+
+def main(args):
+    if args[:1] in (['--version'], ['-v']):
+        sys.stdout.write(VERSION)
+        return 0
+
+    if len(args) < 2:
+        sys.stderr.write('Usage: stub_tesseract.py imagename outputbase\n')
+        return 1
+
+    input_filename, output_base = args[:2]
+    if input_filename in {'stdin', '-'}:
+        getattr(sys.stdin, 'buffer', sys.stdin).read()
+    elif not os.path.exists(input_filename):
+        sys.stderr.write(
+            'Error, cannot read input file {}\n'.format(input_filename)
+        )
+        return 1
+
+    word_count = int(os.environ.get('STUB_TESSERACT_WORDS', 100))
+    pages = int(os.environ.get('STUB_TESSERACT_PAGES', 1))
+    for extension in get_extensions(args[2:]):
+        output = RENDERERS[extension](pages, word_count).encode('utf-8')
+        if output_base in {'stdout', '-'}:
+            getattr(sys.stdout, 'buffer', sys.stdout).write(output)
+            continue
+
+        with open('{}.{}'.format(output_base, extension), 'wb') as output_file:
+            output_file.write(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
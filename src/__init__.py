@@ -1,15 +1,33 @@
 from .pytesseract import (  # noqa: F401
     Data,
     DataLine,
+    Deadline,
+    Engine,
+    LibtesseractEngine,
     Output,
+    OutputCache,
+    SubprocessEngine,
     TesseractError,
     TesseractNotFoundError,
+    TesseractSession,
+    Trace,
+    Transport,
     TSVNotSupported,
+    UsageStats,
+    get_last_usage,
     get_tesseract_version,
     image_to_boxes,
     image_to_data,
     image_to_osd,
+    image_to_outputs,
     image_to_pdf_or_hocr,
     image_to_string,
+    image_to_string_regions,
+    images_to_data,
+    images_to_string,
+    iter_hocr,
+    iter_pages,
+    map_images,
     run_and_get_output,
+    tracing,
 )
@@ -0,0 +1,323 @@
+"""
+asyncio variants of the pytesseract image_to_* functions (Python 3.5+).
+Tesseract runs in asyncio subprocesses, so many images can be processed from
+one event loop without a thread per call.
+"""
+import asyncio
+from errno import ENOENT
+from os import extsep
+
+from . import pytesseract
+from .pytesseract import (
+    BOX_HEADER,
+    PIPE_EXTENSIONS,
+    Data,
+    EncodedImage,
+    Output,
+    TesseractError,
+    TesseractNotFoundError,
+    Transport,
+    TSVNotSupported,
+    cache_key,
+    decode_output,
+    engine_older_than,
+    file_to_dict,
+    get_cache,
+    get_engine,
+    get_errors,
+    get_input,
+    get_timeout,
+    hocr_to_dict,
+    iter_hocr,
+    kill_process,
+    osd_to_dict,
+    pipe,
+    runs_executable,
+    save,
+    subprocess_args,
+    tsv_to_numpy,
+    tsv_to_pandas,
+)
+
+
+def in_executor(func, *args):
+    """
+    Runs func in the default executor, so that encoding the image, hashing
+    it, file I/O and looking up the tesseract version don't block the event
+    loop.
+    """
+    return asyncio.get_event_loop().run_in_executor(None, func, *args)
+
+
+def read_output(filename):
+    with open(filename, 'rb') as output_file:
+        return output_file.read()
+
+
+async def run_process(cmd_args, timeout=0, input_bytes=None, kwargs=None):
+    timeout = get_timeout(timeout)
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd_args, **(kwargs or subprocess_args())
+        )
+    except OSError as e:
+        if e.errno != ENOENT:
+            raise e
+        raise TesseractNotFoundError()
+
+    try:
+        output, error_string = await asyncio.wait_for(
+            proc.communicate(input_bytes), timeout or None,
+        )
+    except asyncio.TimeoutError:
+        raise RuntimeError('Tesseract process timeout')
+    finally:
+        # kill the child if the call timed out or the task got cancelled
+        if proc.returncode is None:
+            kill_process(proc)
+            await proc.wait()
+
+    if proc.returncode:
+        raise TesseractError(proc.returncode, get_errors(error_string))
+    return output
+
+
+async def run_and_get_output(
+    image,
+    extension='',
+    lang=None,
+    config='',
+    nice=0,
+    timeout=0,
+    return_bytes=False,
+    transport=None,
+    env=None,
+    cache=None,
+    semaphore=None,
+    engine=None,
+):
+    """
+    Coroutine version of pytesseract.run_and_get_output. If a semaphore is
+    given, it bounds the number of concurrently running tesseract processes.
+    Engines which don't run the executable run in the default executor, as
+    do the encoding of the image, the cache lookups and the file I/O.
+    """
+    cache = get_cache(cache)
+    if cache is not None:
+        image = await in_executor(EncodedImage, image)
+        key = await in_executor(
+            cache_key, image, extension, lang, config, engine,
+        )
+        output = await in_executor(cache.get, key)
+        if output is None:
+            output = await run_and_get_output(
+                get_input(image, get_engine(engine)),
+                extension,
+                lang,
+                config,
+                nice,
+                timeout,
+                True,
+                transport,
+                env,
+                False,
+                semaphore,
+                engine,
+            )
+            await in_executor(cache.set, key, output)
+        return decode_output(output, return_bytes)
+
+    if semaphore is not None:
+        async with semaphore:
+            return await run_and_get_output(
+                image,
+                extension,
+                lang,
+                config,
+                nice,
+                timeout,
+                return_bytes,
+                transport,
+                env,
+                False,
+                None,
+                engine,
+            )
+
+    engine = get_engine(engine)
+    if not runs_executable(engine):
+        output = await in_executor(
+            engine.run,
+            image,
+            extension,
+            lang,
+            config,
+            nice,
+            timeout,
+            transport,
+            env,
+        )
+        return decode_output(output, return_bytes)
+
+    if transport is None:
+        transport = pytesseract.default_transport
+
+    args = [extension, lang, config, nice]
+    kwargs = engine.subprocess_args(env)
+
+    if transport == Transport.PIPE and extension in PIPE_EXTENSIONS:
+        input_filename, input_bytes = await in_executor(pipe, image)
+        cmd_args = engine.get_cmd_args(input_filename, 'stdout', *args)
+        output = await run_process(cmd_args, timeout, input_bytes, kwargs)
+        return decode_output(output, return_bytes)
+
+    # the saved context is entered and exited in the executor
+    saved = save(image, engine.directory, [extension])
+    temp_name, input_filename = await in_executor(saved.__enter__)
+    try:
+        cmd_args = engine.get_cmd_args(input_filename, temp_name, *args)
+        await run_process(cmd_args, timeout, None, kwargs)
+        output = await in_executor(
+            read_output, temp_name + extsep + extension,
+        )
+    finally:
+        await in_executor(saved.__exit__, None, None, None)
+    return decode_output(output, return_bytes)
+
+
+async def image_to_string(
+    image,
+    lang=None,
+    config='',
+    nice=0,
+    output_type=Output.STRING,
+    timeout=0,
+    **kwargs
+):
+    """
+    Returns the result of a Tesseract OCR run on the provided image to string
+    """
+    args = [image, 'txt', lang, config, nice, timeout, True]
+
+    convert = {
+        Output.BYTES: lambda output: output,
+        Output.DICT: lambda output: {'text': decode_output(output)},
+        Output.STRING: decode_output,
+    }[output_type]
+    return convert(await run_and_get_output(*args, **kwargs))
+
+
+async def image_to_pdf_or_hocr(
+    image,
+    lang=None,
+    config='',
+    nice=0,
+    extension='pdf',
+    timeout=0,
+    output_type=Output.BYTES,
+    **kwargs
+):
+    """
+    Returns the result of a Tesseract OCR run on the provided image to pdf/hocr
+    """
+
+    if extension not in {'pdf', 'hocr'}:
+        raise ValueError('Unsupported extension: {}'.format(extension))
+    if extension == 'pdf' and output_type != Output.BYTES:
+        raise ValueError('Unsupported output type for pdf: ' + output_type)
+    args = [image, extension, lang, config, nice, timeout, True]
+
+    convert = {
+        Output.BYTES: lambda output: output,
+        Output.DICT: lambda output: hocr_to_dict(iter_hocr(output)),
+        Output.STRING: decode_output,
+    }[output_type]
+    return convert(await run_and_get_output(*args, **kwargs))
+
+
+async def image_to_boxes(
+    image,
+    lang=None,
+    config='',
+    nice=0,
+    output_type=Output.STRING,
+    timeout=0,
+    **kwargs
+):
+    """
+    Returns string containing recognized characters and their box boundaries
+    """
+    config += ' batch.nochop makebox'
+    args = [image, 'box', lang, config, nice, timeout, True]
+
+    convert = {
+        Output.BYTES: lambda output: output,
+        Output.DICT: lambda output: file_to_dict(
+            ' '.join(BOX_HEADER) + '\n' + decode_output(output), ' ', 0,
+        ),
+        Output.NUMPY: lambda output: tsv_to_numpy(output, ' ', BOX_HEADER),
+        Output.STRING: decode_output,
+    }[output_type]
+    return convert(await run_and_get_output(*args, **kwargs))
+
+
+async def image_to_data(
+    image,
+    lang=None,
+    config='',
+    nice=0,
+    output_type=Output.STRING,
+    timeout=0,
+    pandas_config=None,
+    **kwargs
+):
+    """
+    Returns string containing box boundaries, confidences,
+    and other information. Requires Tesseract 3.05+
+    """
+
+    engine = kwargs.get('engine')
+    if await in_executor(engine_older_than, engine, '3.05'):
+        raise TSVNotSupported()
+
+    config = '{} {}'.format('-c tessedit_create_tsv=1', config.strip()).strip()
+    args = [image, 'tsv', lang, config, nice, timeout, True]
+
+    convert = {
+        Output.BYTES: lambda output: output,
+        Output.DATAFRAME: lambda output: tsv_to_pandas(output, pandas_config),
+        Output.DICT: lambda output: file_to_dict(
+            decode_output(output), '\t', -1,
+        ),
+        Output.NUMPY: lambda output: tsv_to_numpy(output, '\t'),
+        Output.STRING: decode_output,
+        Output.OBJECT: lambda output: Data(decode_output(output)),
+    }[output_type]
+    return convert(await run_and_get_output(*args, **kwargs))
+
+
+async def image_to_osd(
+    image,
+    lang='osd',
+    config='',
+    nice=0,
+    output_type=Output.STRING,
+    timeout=0,
+    **kwargs
+):
+    """
+    Returns string containing the orientation and script detection (OSD)
+    """
+    engine = kwargs.get('engine')
+    old_engine = await in_executor(engine_older_than, engine, '3.05')
+    config = '{}-psm 0 {}'.format(
+        '' if old_engine else '-', config.strip(),
+    ).strip()
+    args = [image, 'osd', lang, config, nice, timeout, True]
+
+    convert = {
+        Output.BYTES: lambda output: output,
+        Output.DICT: lambda output: osd_to_dict(decode_output(output)),
+        Output.STRING: decode_output,
+    }[output_type]
+    return convert(await run_and_get_output(*args, **kwargs))
@@ -0,0 +1,358 @@
+"""
+In-process OCR with the C API of libtesseract, loaded through ctypes.
+The initialized TessBaseAPI handles are kept in a thread-local pool per
+(lang, config), so the traineddata is loaded once per thread instead of
+once per call. The pool keeps the max_handles most recently used handles.
+"""
+import ctypes
+import shlex
+from collections import OrderedDict
+from ctypes.util import find_library
+from threading import local
+
+from .pytesseract import Image, TesseractError, is_ndarray, prepare
+
+library_path = None  # path of libtesseract, looked up if None
+max_handles = 4  # initialized handles kept per thread
+
+LIBRARY_NAMES = ('tesseract', 'libtesseract-5', 'libtesseract-4')
+OEM_DEFAULT = 3
+TSV_HEADER = (
+    b'level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\t'
+    b'left\ttop\twidth\theight\tconf\ttext\n'
+)
+HOCR_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN"\n'
+    '    "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">\n'
+    '<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en">\n'
+    ' <head>\n'
+    '  <title></title>\n'
+    '  <meta http-equiv="Content-Type" content="text/html;charset=utf-8"/>\n'
+    "  <meta name='ocr-system' content='tesseract {}' />\n"
+    "  <meta name='ocr-capabilities' content='ocr_page ocr_carea ocr_par"
+    " ocr_line ocrx_word ocrp_wconf'/>\n"
+    ' </head>\n'
+    ' <body>\n'
+)
+HOCR_FOOTER = b' </body>\n</html>\n'
+
+# extension: (C API function returning the text, takes a page number)
+TEXT_FUNCTIONS = {
+    'box': ('TessBaseAPIGetBoxText', True),
+    'hocr': ('TessBaseAPIGetHOCRText', True),
+    'tsv': ('TessBaseAPIGetTsvText', True),
+    'txt': ('TessBaseAPIGetUTF8Text', False),
+}
+
+pool = local()
+libraries = {}  # the loaded library (or None) by library_path
+
+
+def load_library():
+    """
+    Returns libtesseract with the used C API functions declared, or None if
+    the library can't be found. It's looked up once per library_path.
+    """
+    if library_path not in libraries:
+        libraries[library_path] = open_library(library_path)
+    return libraries[library_path]
+
+
+def open_library(library_path):
+    names = [library_path] if library_path else LIBRARY_NAMES
+    for name in names:
+        path = name if library_path else find_library(name)
+        if not path:
+            continue
+        try:
+            library = ctypes.CDLL(path)
+        except OSError:
+            continue
+        break
+    else:
+        return None
+
+    handle, text = ctypes.c_void_p, ctypes.c_void_p
+    signatures = {
+        'TessVersion': (ctypes.c_char_p, []),
+        'TessBaseAPICreate': (handle, []),
+        'TessBaseAPIDelete': (None, [handle]),
+        'TessBaseAPIEnd': (None, [handle]),
+        'TessBaseAPIInit4': (
+            ctypes.c_int,
+            [
+                handle,
+                ctypes.c_char_p,
+                ctypes.c_char_p,
+                ctypes.c_int,
+                ctypes.POINTER(ctypes.c_char_p),
+                ctypes.c_int,
+                ctypes.POINTER(ctypes.c_char_p),
+                ctypes.POINTER(ctypes.c_char_p),
+                ctypes.c_size_t,
+                ctypes.c_int,
+            ],
+        ),
+        'TessBaseAPISetPageSegMode': (None, [handle, ctypes.c_int]),
+        'TessBaseAPISetImage': (
+            None,
+            [
+                handle,
+                ctypes.c_void_p,
+                ctypes.c_int,
+                ctypes.c_int,
+                ctypes.c_int,
+                ctypes.c_int,
+            ],
+        ),
+        'TessBaseAPISetSourceResolution': (None, [handle, ctypes.c_int]),
+        'TessBaseAPIRecognize': (ctypes.c_int, [handle, ctypes.c_void_p]),
+        'TessBaseAPIGetUTF8Text': (text, [handle]),
+        'TessBaseAPIGetBoxText': (text, [handle, ctypes.c_int]),
+        'TessBaseAPIGetHOCRText': (text, [handle, ctypes.c_int]),
+        'TessBaseAPIGetTsvText': (text, [handle, ctypes.c_int]),
+        'TessBaseAPIClear': (None, [handle]),
+        'TessDeleteText': (None, [text]),
+    }
+    for name, (restype, argtypes) in signatures.items():
+        try:
+            function = getattr(library, name)
+        except AttributeError:
+            return None  # e.g. Tesseract 3, which has no TessBaseAPIInit4
+        function.restype = restype
+        function.argtypes = argtypes
+
+    return library
+
+
+def is_available():
+    return load_library() is not None
+
+
+def parse_config(config):
+    """
+    Splits a tesseract command line config into the Init arguments, variables,
+    page segmentation mode and resolution. Returns None if the config has
+    options, which only the tesseract executable supports.
+    """
+    options = {
+        'tessdata_dir': None,
+        'oem': OEM_DEFAULT,
+        'psm': None,
+        'dpi': None,
+        'configs': [],
+        'variables': [],
+    }
+    args = iter(shlex.split(config))
+    try:
+        for arg in args:
+            if arg == '--tessdata-dir':
+                options['tessdata_dir'] = next(args)
+            elif arg in {'--oem', '-oem'}:
+                options['oem'] = int(next(args))
+            elif arg in {'--psm', '-psm'}:
+                options['psm'] = int(next(args))
+            elif arg == '--dpi':
+                options['dpi'] = int(next(args))
+            elif arg == '-c':
+                options['variables'].append(next(args).split('=', 1))
+            elif arg == '--user-words':
+                options['variables'].append(['user_words_file', next(args)])
+            elif arg == '--user-patterns':
+                options['variables'].append(['user_patterns_file', next(args)])
+            elif arg.startswith('-'):
+                return None
+            else:
+                options['configs'].append(arg)
+    except (StopIteration, ValueError):
+        return None
+
+    if any(len(variable) != 2 for variable in options['variables']):
+        return None
+    return options
+
+
+def encode(value):
+    return None if value is None else value.encode('utf-8')
+
+
+def to_array(values):
+    """
+    Returns a C array of the encoded strings, or None if there are none.
+    """
+    values = [encode(value) for value in values]
+    return (ctypes.c_char_p * len(values))(*values) if values else None
+
+
+class Handle:
+    """
+    An initialized TessBaseAPI, which is ended when it gets garbage collected.
+    """
+
+    def __init__(self, library, lang, options):
+        self.library = library
+        self.api = library.TessBaseAPICreate()
+
+        # the variables are passed to Init like the tesseract executable does,
+        # since variables which are only read by Init can't be set afterwards
+        configs = to_array(options['configs'])
+        names = to_array(name for name, _ in options['variables'])
+        values = to_array(value for _, value in options['variables'])
+        status = library.TessBaseAPIInit4(
+            self.api,
+            encode(options['tessdata_dir']),
+            encode(lang),
+            options['oem'],
+            configs,
+            len(configs or ()),
+            names,
+            values,
+            len(names or ()),
+            False,
+        )
+        if status != 0:
+            self.close()
+            raise TesseractError(
+                status,
+                'Failed to initialize tesseract with lang {}'.format(
+                    lang or 'eng',
+                ),
+            )
+
+        if options['psm'] is not None:
+            library.TessBaseAPISetPageSegMode(self.api, options['psm'])
+
+    def close(self):
+        if self.api:
+            self.library.TessBaseAPIEnd(self.api)
+            self.library.TessBaseAPIDelete(self.api)
+            self.api = None
+
+    def __del__(self):
+        self.close()
+
+
+def get_handle(library, lang, config, options):
+    """
+    Returns the handle of the calling thread for lang and config. The least
+    recently used handles beyond max_handles are ended.
+    """
+    handles = getattr(pool, 'handles', None)
+    if handles is None:
+        handles = pool.handles = OrderedDict()
+
+    key = (lang, config)
+    handle = handles.pop(key, None)
+    if handle is None:
+        handle = Handle(library, lang, options)
+    handles[key] = handle
+
+    while len(handles) > max(1, max_handles):
+        handles.popitem(last=False)[1].close()
+    return handle
+
+
+def get_pixels(image):
+    """
+    Returns the pixel buffer of the image with its width, height, bytes per
+    pixel, bytes per line and resolution, or None if the image can't be
+    passed to the C API (e.g. multi page images). The memory of 8 bit
+    grayscale and RGB NumPy arrays is passed as it is, without a copy.
+    """
+    if is_ndarray(image):
+        channels = 1 if image.ndim == 2 else image.shape[-1]
+        if (
+            image.dtype == 'uint8'
+            and image.ndim in {2, 3}
+            and channels in {1, 3}
+            and image.strides[0] > 0
+            and image.strides[1] == channels
+            and image.strides[-1] == 1
+        ):
+            height, width = image.shape[:2]
+            bytes_per_line = image.strides[0]
+            buffer = image.ctypes.data
+            return buffer, width, height, channels, bytes_per_line, 0
+
+    if isinstance(image, str):
+        try:
+            opened = Image.open(image)
+        except IOError:
+            return None  # e.g. a list file of images
+        with opened:
+            return get_pixels(opened)
+
+    if isinstance(image, Image.Image) and getattr(image, 'n_frames', 1) > 1:
+        return None
+
+    dpi = getattr(image, 'info', {}).get('dpi', (0,))[0]
+    image, _ = prepare(image)
+    if image.mode == '1':
+        image = image.convert('L')
+
+    width, height = image.size
+    channels = len(image.mode)
+    bytes_per_line = width * channels
+    return image.tobytes(), width, height, channels, bytes_per_line, int(dpi)
+
+
+def get_text(library, api, extension):
+    name, takes_page = TEXT_FUNCTIONS[extension]
+    args = (api, 0) if takes_page else (api,)
+    text = getattr(library, name)(*args)
+    if not text:
+        raise TesseractError(-1, 'Failed to get the {} output'.format(name))
+
+    try:
+        return ctypes.string_at(text)
+    finally:
+        library.TessDeleteText(text)
+
+
+def run(image, extension, lang=None, config=''):
+    """
+    Returns the output of an in-process OCR run on the image, or None if
+    the library, the extension, the image or the config isn't supported, in
+    which case the tesseract executable is needed.
+    """
+    if extension not in TEXT_FUNCTIONS:
+        return None
+
+    library = load_library()
+    if library is None:
+        return None
+
+    options = parse_config(config)
+    if options is None:
+        return None
+
+    pixels = get_pixels(image)
+    if pixels is None:
+        return None
+
+    buffer, width, height, channels, bytes_per_line, dpi = pixels
+    dpi = options['dpi'] or dpi
+
+    api = get_handle(library, lang, config, options).api
+    try:
+        library.TessBaseAPISetImage(
+            api, buffer, width, height, channels, bytes_per_line,
+        )
+        if dpi:
+            library.TessBaseAPISetSourceResolution(api, dpi)
+
+        status = library.TessBaseAPIRecognize(api, None)
+        if status != 0:
+            raise TesseractError(status, 'Failed to recognize the image')
+
+        output = get_text(library, api, extension)
+    finally:
+        library.TessBaseAPIClear(api)
+
+    if extension == 'tsv':
+        return TSV_HEADER + output
+    if extension == 'hocr':
+        header = HOCR_HEADER.format(library.TessVersion().decode('utf-8'))
+        return header.encode('utf-8') + output + HOCR_FOOTER
+    return output
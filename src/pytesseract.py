@@ -1,38 +1,113 @@
 #!/usr/bin/env python
 
+import atexit
 import shlex
 import string
 import subprocess
 import sys
+from array import array
+from collections import OrderedDict, deque, namedtuple
 from contextlib import contextmanager
 from csv import QUOTE_NONE
-from distutils.version import LooseVersion
-from errno import ENOENT
+from errno import ECHILD, EEXIST, ENOENT, ESRCH
 from functools import wraps
 from glob import iglob
+from hashlib import sha256
+from heapq import heappop, heappush
 from io import BytesIO
-from os import environ, extsep, remove
-from os.path import normcase, normpath, realpath
-from pkgutil import find_loader
-from tempfile import NamedTemporaryFile
-from threading import Timer
+from itertools import count, islice
+from multiprocessing import cpu_count
+from multiprocessing.util import Finalize
+from os import (
+    environ,
+    extsep,
+    getpid,
+    kill,
+    listdir,
+    makedirs,
+    remove,
+    rename,
+    utime,
+)
+from os.path import (
+    abspath,
+    dirname,
+    getmtime,
+    getsize,
+    isdir,
+    join,
+    normcase,
+    normpath,
+    realpath,
+)
+from shutil import copyfileobj, rmtree
+from tempfile import NamedTemporaryFile, TemporaryFile, gettempdir, mkdtemp
+from threading import Condition, Lock, Thread, local
+from time import time
+from timeit import default_timer
+from types import GeneratorType
+from warnings import catch_warnings, simplefilter
 
 try:
     from PIL import Image
 except ImportError:
     import Image
 
-tesseract_cmd = 'tesseract'
+try:
+    from os import replace
+except ImportError:
+    from os import rename as replace  # Python 2, which replaces on POSIX
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue  # Python 2
 
-numpy_installed = find_loader('numpy') is not None
-if numpy_installed:
-    from numpy import ndarray
+try:
+    from os import killpg, setsid, wait4
+    from signal import SIGKILL
+except ImportError:
+    killpg = setsid = wait4 = None  # e.g. on Windows
 
-pandas_installed = find_loader('pandas') is not None
-if pandas_installed:
-    import pandas as pd
+tesseract_cmd = 'tesseract'
+tesseract_versions = {}  # of the tesseract commands, by get_tesseract_version
+default_transport = 'file'  # one of the Transport values
+default_engine = 'subprocess'  # one of the Engine values or an engine object
+default_cache = None  # OutputCache used when no cache is passed
+intermediate_format = 'PPM'  # for images without a source format
+scratch_dir = None  # of the temporary files (e.g. '/dev/shm'), see save
+trace_hooks = []  # called with the Trace of each OCR call, see tracing
+usage_stats = None  # UsageStats, which sums up the usage of all runs
 
 RGB_MODE = 'RGB'
+GRAYSCALE_MODE = 'L'
+SOURCE_MODES = {'1', GRAYSCALE_MODE, RGB_MODE}
+PREPARED_MODES = SOURCE_MODES | {'LA', 'RGBA'}
+MODE_CONVERSIONS = {
+    'F': GRAYSCALE_MODE,
+    'I': GRAYSCALE_MODE,
+    'La': 'LA',
+    'PA': 'RGBA',
+    'RGBa': 'RGBA',
+}
+INTERMEDIATE_FORMAT_PARAMS = {
+    'PNG': {'compress_level': 0},
+    'TIFF': {'compression': 'raw'},
+}
+BATCH_CHUNK_SIZE = 100
+OUTPUT_CHUNK_SIZE = 1 << 20  # bytes copied at once to output streams
+SCRATCH_PREFIX = 'pytesseract_'  # of the directory of each process
+SWEEP_AGE = 3600  # seconds after which temporary files are stale
+PAGE_SEPARATOR = '\f'
+PIPE_EXTENSIONS = {'box', 'hocr', 'pdf', 'tsv', 'txt'}
+# the configs, which make tesseract write an output, see image_to_outputs
+OUTPUT_CONFIGS = {
+    'box': 'makebox',
+    'hocr': 'hocr',
+    'pdf': 'pdf',
+    'tsv': '-c tessedit_create_tsv=1',
+    'txt': 'txt',
+}
 SUPPORTED_FORMATS = {
     'JPEG',
     'PNG',
@@ -45,6 +120,38 @@ SUPPORTED_FORMATS = {
     'WEBP',
 }
 
+MAP_FUNCTIONS = {
+    'image_to_boxes',
+    'image_to_data',
+    'image_to_osd',
+    'image_to_pdf_or_hocr',
+    'image_to_string',
+}
+
+COLUMN_TYPES = {
+    # image_to_data
+    'level': int,
+    'page_num': int,
+    'block_num': int,
+    'par_num': int,
+    'line_num': int,
+    'word_num': int,
+    'left': int,
+    'top': int,
+    'width': int,
+    'height': int,
+    'conf': float,
+    'text': str,
+    # image_to_boxes
+    'char': str,
+    'bottom': int,
+    'right': int,
+    'page': int,
+}
+ARRAY_TYPECODES = {int: 'l', float: 'd'}
+NUMPY_TYPES = {int: 'i4', float: 'f8', str: 'O'}
+BOX_HEADER = ['char', 'left', 'bottom', 'right', 'top', 'page']
+
 OSD_KEYS = {
     'Page number': ('page_num', int),
     'Orientation in degrees': ('orientation', int),
@@ -61,6 +168,23 @@ class Output:
     DICT = 'dict'
     STRING = 'string'
     OBJECT = 'object'
+    NUMPY = 'numpy'
+    ITER = 'iter'
+
+
+class Transport:
+    FILE = 'file'
+    PIPE = 'pipe'
+
+
+class Engine:
+    SUBPROCESS = 'subprocess'
+    LIBTESSERACT = 'libtesseract'
+
+
+class NumpyNotSupported(EnvironmentError):
+    def __init__(self):
+        super(NumpyNotSupported, self).__init__('Missing numpy package')
 
 
 class PandasNotSupported(EnvironmentError):
@@ -89,109 +213,732 @@ class TSVNotSupported(EnvironmentError):
         )
 
 
-class DataLine:
-    def __init__(self, data_string, headers):
-        """
-        Presents data from image as object.
-        :param data_string: str
-        :param headers: str
-        """
-        """
-        The following attributes are expected to be available with tesseract
-        version 5, 4 and 3.05+, this may change with future versions of
-        tesseract.
-        Regardless of this the returned object has all attributes found in
-        the header string.
-        This also assists IDE's in autodecting available parameters and types.
-        Default values ensure compatibility with python < 3.6.
+class Trace:
+    """
+    Durations (in seconds) of the stages of an OCR call (prepare, encode,
+    spawn, run, read and parse) and sizes (input_pixels, encoded_bytes and
+    output_bytes), which are reported to the trace_hooks. Stages and sizes
+    which occur several times (e.g. in batches) are summed up.
+    """
+
+    def __init__(self, function):
+        self.function = function
+        self.extension = None
+        self.lang = None
+        self.config = None
+        self.stages = OrderedDict()
+        self.sizes = OrderedDict()
+        self.error = None
+        self.start = time()
+        self.duration = 0
+        self.started = default_timer()
+
+    def add_stage(self, name, duration):
+        self.stages[name] = self.stages.get(name, 0) + duration
+
+    def add_size(self, name, size):
+        self.sizes[name] = self.sizes.get(name, 0) + size
+
+    def finish(self):
+        self.duration = default_timer() - self.started
+
+    def __repr__(self):
+        values = ['{:.2f}ms'.format(self.duration * 1000)]
+        values += [
+            '{}={:.2f}ms'.format(name, duration * 1000)
+            for name, duration in self.stages.items()
+        ]
+        values += [
+            '{}={}'.format(name, size) for name, size in self.sizes.items()
+        ]
+        return 'Trace({} {} lang={} config={!r}: {})'.format(
+            self.function,
+            self.extension,
+            self.lang,
+            self.config,
+            ' '.join(values),
+        )
+
+
+trace_state = local()  # the Trace of the running call of each thread
+
+
+def get_trace():
+    return getattr(trace_state, 'trace', None)
+
+
+class TraceStage:
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.started = default_timer()
+
+    def __exit__(self, *args):
+        self.trace.add_stage(self.name, default_timer() - self.started)
+
+
+class NoTraceStage:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+
+NO_TRACE_STAGE = NoTraceStage()
+
+
+def trace_stage(name):
+    """
+    Returns a context manager, which adds its duration to the stage of the
+    running Trace. Without a trace it does nothing.
+    """
+    trace = get_trace()
+    if trace is None:
+        return NO_TRACE_STAGE
+    return TraceStage(trace, name)
+
+
+def timed(name):
+    """
+    Decorator adding the duration of the function to the stage name.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with trace_stage(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def report_trace(trace):
+    trace.finish()
+    for hook in list(trace_hooks):
+        hook(trace)
+
+
+def traced_iter(trace, iterator):
+    """
+    Yields the items of the iterator returned by a traced call (e.g. for
+    Output.ITER), which is traced while the items are produced. The trace is
+    reported when the iterator is exhausted, fails or is closed.
+    """
+    try:
+        while True:
+            previous, trace_state.trace = get_trace(), trace
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                trace_state.trace = previous
+            yield item
+    except Exception as e:
+        trace.error = e
+        raise
+    finally:
+        report_trace(trace)
+
+
+def traced(func):
+    """
+    Decorator tracing the calls of an OCR function, if there are trace_hooks.
+    Calls within a traced call are part of its trace. The trace of a call
+    returning a generator covers its iteration, see traced_iter.
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not trace_hooks or get_trace() is not None:
+            return func(*args, **kwargs)
+
+        trace = trace_state.trace = Trace(func.__name__)
+        result = None
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            trace.error = e
+            raise
+        finally:
+            trace_state.trace = None
+            if not isinstance(result, GeneratorType):
+                report_trace(trace)
+
+        if isinstance(result, GeneratorType):
+            return traced_iter(trace, result)
+        return result
+
+    return wrapper
+
+
+@contextmanager
+def tracing(hook):
+    """
+    Calls hook with the Trace of each OCR call within the context.
+    """
+    trace_hooks.append(hook)
+    try:
+        yield hook
+    finally:
+        trace_hooks.remove(hook)
+
+
+class IntCache(dict):
+    """
+    Maps strings to their int values. Looking up the few distinct values of
+    TSV columns is a lot faster than parsing every cell.
+    """
+
+    max_size = 1 << 16
+
+    def __missing__(self, key):
+        value = int(key)
+        if len(self) < self.max_size:
+            self[key] = value
+        return value
+
+
+int_cache = IntCache()
+
+
+def column_property(name, default=-2):
+    def getter(line):
+        column = line.data.columns.get(name)
+        return default if column is None else column[line.index]
+
+    return property(getter)
+
+
+class DataLine(object):
+    """
+    Presents one line of a Data object as object, the values are read from
+    the columns of the Data object.
+    The following attributes are expected to be available with tesseract
+    version 5, 4 and 3.05+, this may change with future versions of
+    tesseract: level, page_num, block_num, par_num, line_num, word_num,
+    left, top, width, height, conf and text.
+    Regardless of this the object has all attributes found in the header
+    string. Expected attributes missing from it have the default values.
+    This also assists IDE's in autodecting available parameters.
+    """
+
+    __slots__ = ('data', 'index')
+
+    default_int = -2
+    default_str = '\t'
+
+    level = column_property('level')
+    page_num = column_property('page_num')
+    block_num = column_property('block_num')
+    par_num = column_property('par_num')
+    line_num = column_property('line_num')
+    word_num = column_property('word_num')
+    left = column_property('left')
+    top = column_property('top')
+    width = column_property('width')
+    height = column_property('height')
+    conf = column_property('conf')
+    text = column_property('text', default_str)
+
+    def __init__(self, data, index):
         """
-        self.default_int = -2
-        self.default_str = '\t'
-
-        self.level = self.default_int
-        self.page_num = self.default_int
-        self.block_num = self.default_int
-        self.par_num = self.default_int
-        self.line_num = self.default_int
-        self.word_num = self.default_int
-        self.left = self.default_int
-        self.top = self.default_int
-        self.width = self.default_int
-        self.height = self.default_int
-        self.conf = self.default_int
-        self.text = self.default_str
-
-        self.__fill_from_string(data_string, headers)
-
-    def __fill_from_string(self, data_string, headers):
+        :param data: Data or str, a single TSV row
+        :param index: int or list, the headers of a single TSV row
         """
+        if not isinstance(data, Data):
+            data, index = Data('\t'.join(index) + '\n' + data), 0
 
-        :param data_string:str
-        :param headers: str
-        :return: None
-        """
-        data_list = data_string.split('\t')
-        for i in range(len(headers)):
-            try:
-                setattr(self, headers[i], int(data_list[i]))
-            except ValueError:
-                setattr(self, headers[i], data_list[i])
+        self.data = data
+        self.index = index
+
+    def __getattr__(self, name):
+        if name in DataLine.__slots__ or name.startswith('__'):
+            raise AttributeError(name)
+
+        # columns which are not known to be in the tesseract output
+        column = self.data.columns.get(name)
+        if column is None:
+            raise AttributeError(name)
+        return column[self.index]
 
     def __str__(self):
-        slist = []
-        for key in self.__dict__.keys():
-            slist.append(str(self.__dict__[key]))
-        return '\t'.join(slist)
+        return self.data.row_str(self.index)
 
 
 class Data:
+    @timed('parse')
     def __init__(self, data_str):
         """
         Python object representation of tesseract data as received from
         pytesseract.imagetodata().
-        Contains all lines found in the data_str as DataLine object.
+        The values are stored by column, in typed arrays for the numeric
+        columns, and presented line by line as DataLine objects.
         :param data_str: str
         """
-        self.lines = []
-        data_list = data_str.split('\n')
-        self.header_str = data_list[0]
-        headers = self.header_str.split('\t')
-        for line in data_list[1:]:
-            self.lines.append(DataLine(line, headers))
+        self.header_str = data_str.split('\n', 1)[0]
+        self.headers, columns = split_columns(data_str, '\t')
+        self.length = len(columns[0]) if columns else 0
+        self.columns = {
+            header: data_column(header, values)
+            for header, values in zip(self.headers, columns)
+        }
+
+    @property
+    def lines(self):
+        return list(self)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if not -self.length <= index < self.length:
+            raise IndexError('Data index out of range')
+        return DataLine(self, index % self.length)
 
     def __iter__(self):
-        return self.lines.__iter__()
+        for index in range(self.length):
+            yield DataLine(self, index)
+
+    def row_str(self, index):
+        return '\t'.join(
+            format_value(self.columns[header][index])
+            for header in self.headers
+        )
 
     def __str__(self):
         slist = [self.header_str]
-        for line in self.lines:
-            slist.append(str(line))
+        for index in range(self.length):
+            slist.append(self.row_str(index))
         return '\n'.join(slist)
 
 
-def kill(process, code):
-    process.kill()
-    process.returncode = code
+def data_column(header, values):
+    """
+    Returns the column of a Data object, a typed array for the known numeric
+    columns and a list otherwise. Repeated texts share the same string.
+    """
+    column_type = COLUMN_TYPES.get(header)
+    if column_type in ARRAY_TYPECODES:
+        try:
+            return array(
+                ARRAY_TYPECODES[column_type], map(parser(column_type), values),
+            )
+        except ValueError:
+            pass
 
+    if column_type is str:
+        strings = {}
+        return [strings.setdefault(value, value) for value in values]
 
-@contextmanager
-def timeout_manager(proc, seconds=0):
-    try:
-        if not seconds:
-            yield proc.communicate()[1]
+    column = []
+    for value in values:
+        try:
+            column.append(int(value))
+        except ValueError:
+            column.append(value)
+    return column
+
+
+def format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, float):
+        return repr(value)
+    return u'{}'.format(value)
+
+
+Usage = namedtuple(
+    'Usage', ['user_time', 'system_time', 'max_rss', 'wall_time'],
+)
+usage_state = local()  # the Usage of the last tesseract run of each thread
+
+
+class RusagePopen(subprocess.Popen):
+    """
+    Popen which keeps the resource usage (rusage) of the child, if it's
+    reaped with os.wait4 by wait() (or communicate()). Python 2 reaps the
+    child without the _try_wait hook, so there it's never kept.
+    """
+
+    rusage = None
+
+    def _try_wait(self, wait_flags):
+        # the (POSIX) hook of Popen, which reaps the child
+        if wait4 is None:
+            return subprocess.Popen._try_wait(self, wait_flags)
+
+        try:
+            pid, status, rusage = wait4(self.pid, wait_flags)
+        except OSError as e:
+            if e.errno != ECHILD:
+                raise e
+            return self.pid, 0
+
+        if pid == self.pid:
+            self.rusage = rusage
+        return pid, status
+
+
+def set_usage(proc, wall_time):
+    """
+    Sets the Usage of the finished process as the one of the last run.
+    CPU times and wall time are in seconds, max_rss in bytes.
+    """
+    rusage = getattr(proc, 'rusage', None)
+    if rusage is None:
+        usage_state.usage = None
+        return
+
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    max_rss = rusage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    usage_state.usage = Usage(
+        rusage.ru_utime, rusage.ru_stime, max_rss, wall_time,
+    )
+
+
+def get_last_usage():
+    """
+    Returns the Usage of the last tesseract run of the calling thread, or
+    None if it isn't known (e.g. without os.wait4, on Python 2, for cached
+    outputs or for in-process OCR).
+    """
+    return getattr(usage_state, 'usage', None)
+
+
+class UsageStats:
+    """
+    Process-wide sums of the resource usage of the tesseract runs per
+    (lang, config). Runs are counted while it's set as usage_stats.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.stats = OrderedDict()
+
+    def add(self, lang, config, usage):
+        with self.lock:
+            stats = self.stats.get((lang, config))
+            if stats is None:
+                stats = self.stats[(lang, config)] = {
+                    'runs': 0,
+                    'user_time': 0.0,
+                    'system_time': 0.0,
+                    'wall_time': 0.0,
+                    'max_rss': 0,
+                }
+            stats['runs'] += 1
+            stats['user_time'] += usage.user_time
+            stats['system_time'] += usage.system_time
+            stats['wall_time'] += usage.wall_time
+            stats['max_rss'] = max(stats['max_rss'], usage.max_rss)
+
+    def dump(self):
+        """
+        Returns a list with a dict of the sums of each (lang, config), which
+        can be serialized e.g. with json.dumps.
+        """
+        with self.lock:
+            return [
+                dict(stats, lang=lang, config=config)
+                for (lang, config), stats in self.stats.items()
+            ]
+
+    def clear(self):
+        with self.lock:
+            self.stats.clear()
+
+
+class OutputCache:
+    def __init__(self, max_entries=128, directory=None, max_disk_size=0):
+        """
+        Cache of raw tesseract outputs, keyed by cache_key(). Keeps the
+        max_entries most recently used outputs in memory and, if a directory
+        is given, every output on disk until max_disk_size bytes are exceeded
+        and the least recently used files get removed (0 means no limit).
+        :param max_entries: int
+        :param directory: str
+        :param max_disk_size: int
+        """
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_disk_size = max_disk_size
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk_size = 0
+
+        if directory is None:
             return
 
-        timeout_code = -1
-        timer = Timer(seconds, kill, [proc, timeout_code])
-        timer.start()
+        if not isdir(directory):
+            makedirs(directory)
+        self.disk_size = sum(
+            self.__getsize(join(directory, name))
+            for name in listdir(directory)
+        )
+
+    @property
+    def hits(self):
+        return self.memory_hits + self.disk_hits
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'entries': len(self.entries),
+            'disk_size': self.disk_size,
+        }
+
+    def get(self, key):
+        with self.lock:
+            output = self.entries.pop(key, None)
+            if output is not None:
+                self.entries[key] = output
+                self.memory_hits += 1
+                return output
+
+            output = self.__read(key)
+            if output is None:
+                self.misses += 1
+                return None
+
+            self.disk_hits += 1
+            self.__remember(key, output)
+            return output
+
+    def set(self, key, output):
+        with self.lock:
+            self.__remember(key, output)
+            self.__write(key, output)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            if self.directory is None:
+                return
+
+            for name in listdir(self.directory):
+                self.__remove(join(self.directory, name))
+
+    def __remember(self, key, output):
+        self.entries.pop(key, None)
+        self.entries[key] = output
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def __read(self, key):
+        if self.directory is None:
+            return None
+
+        filename = join(self.directory, key)
         try:
-            _, error_string = proc.communicate()
-            yield error_string
-        finally:
-            timer.cancel()
-            if proc.returncode == timeout_code:
-                raise RuntimeError('Tesseract process timeout')
+            with open(filename, 'rb') as output_file:
+                output = output_file.read()
+            utime(filename, None)  # used for least recently used eviction
+            return output
+        except (IOError, OSError) as e:
+            if e.errno != ENOENT:
+                raise e
+            return None
+
+    def __write(self, key, output):
+        if self.directory is None:
+            return
+
+        filename = join(self.directory, key)
+        with NamedTemporaryFile(dir=self.directory, delete=False) as f:
+            f.write(output)
+        # rename replaces an existing file on POSIX and fails on Windows
+        replaced_size = self.__getsize(filename)
+        try:
+            rename(f.name, filename)
+        except OSError:
+            # the output has been written by another process in the meantime
+            self.__remove(f.name)
+            return
+
+        self.disk_size += len(output) - replaced_size
+        if self.max_disk_size and self.disk_size > self.max_disk_size:
+            self.__evict()
+
+    def __evict(self):
+        files = []
+        for name in listdir(self.directory):
+            filename = join(self.directory, name)
+            try:
+                files.append((getmtime(filename), filename))
+            except OSError as e:
+                # removed by another process sharing the directory
+                if e.errno != ENOENT:
+                    raise e
+
+        for _, filename in sorted(files):
+            if self.disk_size <= self.max_disk_size:
+                break
+            self.__remove(filename)
+
+    def __getsize(self, filename):
+        try:
+            return getsize(filename)
+        except OSError as e:
+            if e.errno != ENOENT:
+                raise e
+            return 0
+
+    def __remove(self, filename):
+        try:
+            size = getsize(filename)
+            remove(filename)
+            self.disk_size -= size
+        except OSError as e:
+            if e.errno != ENOENT:
+                raise e
+
+
+class Deadline:
+    """
+    A point in time after which tesseract runs time out. It can be passed as
+    the timeout of any number of calls (e.g. of a batch or map_images), which
+    share the budget of the deadline instead of each having its own timeout.
+    """
+
+    def __init__(self, seconds):
+        self.expires = default_timer() + seconds
+
+    def remaining(self):
+        return self.expires - default_timer()
+
+    def __repr__(self):
+        return 'Deadline({:.3f})'.format(self.remaining())
+
+
+def get_timeout(timeout):
+    """
+    Returns the seconds left of a timeout in seconds or of a Deadline
+    (0 for no timeout). Raises the timeout error for an expired Deadline.
+    """
+    if not isinstance(timeout, Deadline):
+        return timeout
+
+    seconds = timeout.remaining()
+    if seconds <= 0:
+        raise RuntimeError('Tesseract process timeout')
+    return seconds
+
+
+def kill_process(proc):
+    """
+    Kills the process group of proc, so that the children of tesseract (or of
+    a wrapper script) don't outlive it, or proc if it isn't a group leader.
+    """
+    if killpg is not None:
+        try:
+            killpg(proc.pid, SIGKILL)
+            return
+        except OSError:
+            pass  # not a group leader
+
+    try:
+        proc.kill()
+    except OSError:
+        pass  # already exited
+
+
+class Watchdog:
+    """
+    Kills the processes, which outlive their timeout, from one thread shared
+    by all calls instead of a timer thread per call.
+    """
+
+    def __init__(self):
+        self.condition = Condition()
+        self.entries = []  # heap of [expires, id, proc or None, expired]
+        self.ids = count()
+        self.thread = None
+
+    def watch(self, proc, seconds):
+        entry = [default_timer() + seconds, next(self.ids), proc, False]
+        with self.condition:
+            heappush(self.entries, entry)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = Thread(target=self.run, name='tesseract-timeout')
+                self.thread.daemon = True
+                self.thread.start()
+            self.condition.notify()
+        return entry
+
+    def cancel(self, entry):
+        """
+        Stops watching the process of the entry and returns whether it got
+        killed because of its timeout.
+        """
+        with self.condition:
+            entry[2] = None  # popped from the heap when it's due
+            return entry[3]
+
+    def run(self):
+        with self.condition:
+            while True:
+                while self.entries and self.entries[0][2] is None:
+                    heappop(self.entries)
+                if not self.entries:
+                    self.condition.wait()
+                    continue
+
+                delay = self.entries[0][0] - default_timer()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+
+                entry = heappop(self.entries)
+                entry[3] = True
+                kill_process(entry[2])
+
+
+watchdog = Watchdog()
+
+
+def communicate(proc, seconds, input_bytes):
+    if not seconds:
+        return proc.communicate(input_bytes)
+
+    if hasattr(subprocess, 'TimeoutExpired'):
+        try:
+            return proc.communicate(input_bytes, timeout=seconds)
+        except subprocess.TimeoutExpired:
+            kill_process(proc)
+            proc.communicate()
+            raise RuntimeError('Tesseract process timeout')
+
+    # Python 2, whose communicate has no timeout
+    entry = watchdog.watch(proc, seconds)
+    try:
+        streams = proc.communicate(input_bytes)
+    finally:
+        if watchdog.cancel(entry):
+            raise RuntimeError('Tesseract process timeout')
+    return streams
+
+
+@contextmanager
+def timeout_manager(proc, seconds=0, input_bytes=None):
+    try:
+        yield communicate(proc, seconds, input_bytes)
     finally:
+        if proc.returncode is None:
+            # e.g. interrupted by KeyboardInterrupt
+            kill_process(proc)
+            proc.wait()
         proc.stdin.close()
         proc.stdout.close()
         proc.stderr.close()
@@ -218,170 +965,1399 @@ def cleanup(temp_name):
     """ Tries to remove temp files by filename wildcard path. """
     for filename in iglob(temp_name + '*' if temp_name else temp_name):
         try:
-            remove(filename)
+            remove(filename)
+        except OSError as e:
+            if e.errno != ENOENT:
+                raise e
+
+
+def remove_files(filenames):
+    """ Removes the temp files, which pytesseract created. """
+    for filename in filenames:
+        try:
+            remove(filename)
+        except OSError as e:
+            if e.errno != ENOENT:
+                raise e
+
+
+def is_running(pid):
+    """
+    Returns whether the process pid is running, or None if that can't be
+    checked (on Windows os.kill would terminate it).
+    """
+    if killpg is None:
+        return None
+
+    try:
+        kill(pid, 0)
+    except OSError as e:
+        return e.errno != ESRCH
+    return True
+
+
+def sweep(directory, max_age=SWEEP_AGE):
+    """
+    Removes the temporary files and directories in directory, which killed
+    processes left behind: the tess_* files and the directories of processes
+    which aren't running anymore, which are older than max_age seconds.
+    Entries which can't be removed (e.g. of other users) are skipped.
+    """
+    now = time()
+    try:
+        names = listdir(directory)
+    except OSError:
+        return
+
+    for name in names:
+        filename = join(directory, name)
+        if name.startswith(SCRATCH_PREFIX):
+            # pids of other namespaces sharing the directory aren't visible
+            pid = name.rsplit('_', 1)[-1]
+            if not pid.isdigit() or int(pid) == getpid():
+                continue
+            if is_running(int(pid)):
+                continue
+        elif not name.startswith('tess_'):
+            continue
+
+        try:
+            if now - getmtime(filename) <= max_age:
+                continue
+            if isdir(filename):
+                rmtree(filename, ignore_errors=True)
+            else:
+                remove(filename)
+        except OSError:
+            continue  # removed in the meantime or not ours
+
+
+scratch_lock = Lock()
+
+
+def remove_scratch_dir(directory, pid):
+    """
+    Removes the scratch directory of the process pid. Forked children inherit
+    the exit handlers, but the directory belongs to their parent.
+    """
+    if getpid() == pid:
+        rmtree(directory, True)
+
+
+def get_scratch_dir():
+    """
+    Returns the directory of the temporary files of the current process in
+    scratch_dir (or the default temporary directory), which is created on
+    first use and removed at exit. Creating it sweeps the stale files of
+    killed processes. Outputs which only a config requests (e.g. 'hocr' for
+    image_to_string) stay in it until the process exits.
+    """
+    base = scratch_dir or gettempdir()
+    pid = getpid()
+    directory = join(base, '{}{}'.format(SCRATCH_PREFIX, pid))
+    if isdir(directory):
+        return directory
+
+    with scratch_lock:
+        try:
+            makedirs(directory)
+        except OSError as e:
+            if e.errno != EEXIST:
+                raise e
+            return directory
+
+        atexit.register(remove_scratch_dir, directory, pid)
+        # multiprocessing workers skip the atexit handlers, not finalizers
+        Finalize(None, remove_scratch_dir, (directory, pid), exitpriority=0)
+        sweep(base)
+    return directory
+
+
+def import_numpy():
+    """
+    Imports numpy on first use, so that importing pytesseract doesn't.
+    """
+    try:
+        import numpy
+    except ImportError:
+        raise NumpyNotSupported()
+    return numpy
+
+
+def import_pandas():
+    """
+    Imports pandas on first use, so that importing pytesseract doesn't.
+    """
+    try:
+        import pandas
+    except ImportError:
+        raise PandasNotSupported()
+    return pandas
+
+
+def is_ndarray(image):
+    # the image can't be a numpy array, if numpy hasn't been imported
+    numpy = sys.modules.get('numpy')
+    return numpy is not None and isinstance(image, numpy.ndarray)
+
+
+@timed('prepare')
+def prepare(image):
+    if is_ndarray(image):
+        image = Image.fromarray(image)
+
+    if not isinstance(image, Image.Image):
+        raise TypeError('Unsupported image object')
+
+    trace = get_trace()
+    if trace is not None:
+        trace.add_size('input_pixels', image.size[0] * image.size[1])
+
+    source_format = image.format
+    extension = source_format or intermediate_format
+    if extension not in SUPPORTED_FORMATS:
+        raise TypeError('Unsupported image format/type')
+
+    # keep bilevel and grayscale images in their mode to minimize the payload
+    if image.mode.startswith('I;16'):
+        # scale the 16 bit values down, a plain conversion would clip them
+        image = (
+            image.convert('I')
+            .point(lambda value: value * (1 / 256.0))
+            .convert(GRAYSCALE_MODE)
+        )
+    elif image.mode == 'P':
+        image = image.convert(
+            'RGBA' if 'transparency' in image.info else RGB_MODE,
+        )
+    elif image.mode not in PREPARED_MODES:
+        image = image.convert(MODE_CONVERSIONS.get(image.mode, RGB_MODE))
+
+    if 'A' in image.getbands():
+        # discard and replace the alpha channel with white background
+        background = Image.new(image.mode[:-1], image.size, 'white')
+        background.paste(image, (0, 0), image)
+        image = background
+
+    if 'format' not in image.info:
+        image.info['format'] = extension
+        if not source_format:
+            # encoder parameters for the intermediate format
+            image.info.update(INTERMEDIATE_FORMAT_PARAMS.get(extension, {}))
+    image.format = extension
+
+    return image, extension
+
+
+def get_filename(image):
+    """
+    Returns the path of the image if tesseract can read it without
+    re-encoding. That is the case for file paths and for PIL images, which
+    have been opened from a supported file and not been loaded (so they
+    can't have been modified) yet.
+    """
+    if isinstance(image, str):
+        return realpath(normpath(normcase(image)))
+
+    if (
+        isinstance(image, Image.Image)
+        and getattr(image, 'filename', None)
+        and getattr(image, 'tile', None)
+        and image.format in SUPPORTED_FORMATS
+        and image.mode in SOURCE_MODES
+        and image.tell() == 0
+        and not getattr(image, 'is_animated', False)
+    ):
+        return realpath(normpath(normcase(image.filename)))
+
+    return None
+
+
+@contextmanager
+def save(image, directory=None, extensions=()):
+    """
+    Saves the image to a temporary file in directory (see get_scratch_dir),
+    unless tesseract can read the image file. Yields the temporary name, to
+    which tesseract adds the extensions of its outputs, and the input file
+    name. Exactly these files are removed afterwards.
+    """
+    filenames = []
+    try:
+        with NamedTemporaryFile(
+            prefix='tess_', dir=directory or get_scratch_dir(), delete=False,
+        ) as f:
+            filenames.append(f.name)
+            filenames.extend(f.name + extsep + name for name in extensions)
+            if isinstance(image, EncodedImage):
+                input_file_name = image.filename
+            else:
+                input_file_name = get_filename(image)
+            if input_file_name is not None:
+                yield f.name, input_file_name
+                return
+
+            if isinstance(image, EncodedImage):
+                input_file_name = f.name + extsep + image.extension
+                filenames.append(input_file_name)
+                with open(input_file_name, 'wb') as input_file:
+                    input_file.write(image.data)
+                yield f.name, input_file_name
+                return
+
+            image, extension = prepare(image)
+            input_file_name = f.name + extsep + extension
+            filenames.append(input_file_name)
+            with trace_stage('encode'):
+                image.save(input_file_name, **image.info)
+
+            trace = get_trace()
+            if trace is not None:
+                trace.add_size('encoded_bytes', getsize(input_file_name))
+            yield f.name, input_file_name
+    finally:
+        remove_files(filenames)
+
+
+def get_frame_count(filename):
+    """
+    Returns the number of frames of the image file, 1 if PIL can't read it.
+    """
+    try:
+        with Image.open(filename) as image:
+            return getattr(image, 'n_frames', 1)
+    except IOError:
+        return 1
+
+
+@contextmanager
+def save_batch(images, directory=None):
+    """
+    Saves the images and a list file of their paths, which tesseract accepts
+    as input to process all of them in one run, to directory (see
+    get_scratch_dir). Yields the list file name. Multi-frame image files are
+    rejected, since tesseract would add a page to the output for each frame.
+    """
+    filenames = []
+    try:
+        with NamedTemporaryFile(
+            prefix='tess_', dir=directory or get_scratch_dir(), delete=False,
+        ) as f:
+            filenames.append(f.name)
+            for index, image in enumerate(images):
+                if isinstance(image, str) and get_frame_count(image) > 1:
+                    raise ValueError(
+                        'Multi-frame images are not supported in batches, '
+                        'use iter_pages: {}'.format(image),
+                    )
+
+                input_file_name = get_filename(image)
+                if input_file_name is None:
+                    image, extension = prepare(image)
+                    input_file_name = '{}_{}{}{}'.format(
+                        f.name, index, extsep, extension,
+                    )
+                    filenames.append(input_file_name)
+                    with trace_stage('encode'):
+                        image.save(input_file_name, **image.info)
+                f.write(input_file_name.encode('utf-8') + b'\n')
+        yield f.name
+    finally:
+        remove_files(filenames)
+
+
+class EncodedImage:
+    """
+    The image (see prepare) with its encoded bytes, or with its filename if
+    tesseract can read the image file. Cached calls encode the image once
+    for the cache key and for the run, save and pipe reuse the bytes.
+    """
+
+    def __init__(self, image):
+        self.image = image
+        self.filename = get_filename(image)
+        self.data = self.extension = self._digest = None
+        if self.filename is not None:
+            return
+
+        image, self.extension = prepare(image)
+        image_buffer = BytesIO()
+        with trace_stage('encode'):
+            image.save(image_buffer, **image.info)
+        self.data = image_buffer.getvalue()
+
+        trace = get_trace()
+        if trace is not None:
+            trace.add_size('encoded_bytes', len(self.data))
+
+    def digest(self):
+        """
+        Returns a copy of the sha256 hash of the encoded image, or of the
+        file content if tesseract reads the image file.
+        """
+        if self._digest is None:
+            if self.filename is None:
+                self._digest = sha256(self.data)
+            else:
+                self._digest = sha256()
+                with open(self.filename, 'rb') as input_file:
+                    for chunk in iter(
+                        lambda: input_file.read(OUTPUT_CHUNK_SIZE), b'',
+                    ):
+                        self._digest.update(chunk)
+        return self._digest.copy()
+
+
+def pipe(image):
+    """
+    Returns the input filename and the encoded image bytes for the stdin
+    transport. The bytes are None when tesseract can read the image file.
+    """
+    if not isinstance(image, EncodedImage):
+        image = EncodedImage(image)
+    if image.filename is not None:
+        return image.filename, None
+    return 'stdin', image.data
+
+
+def cache_key(image, extension, lang, config, engine=None):
+    """
+    Returns the hash of the prepared image (or of the file content if
+    tesseract reads the image file) and of the parameters which determine
+    the tesseract output, including the cache_args of the engine. Pass an
+    EncodedImage to hash the image once for several keys.
+    """
+    if not isinstance(image, EncodedImage):
+        image = EncodedImage(image)
+
+    key = image.digest()
+    values = (extension, lang, config, get_engine_version(engine))
+    for value in values + getattr(get_engine(engine), 'cache_args', ()):
+        key.update(u'\0{}'.format(value).encode('utf-8'))
+    return key.hexdigest()
+
+
+def get_cache(cache=None):
+    """
+    Returns the cache for a call, which is the default_cache for None and
+    no cache for False.
+    """
+    if cache is None:
+        return default_cache
+    return cache or None
+
+
+def subprocess_args(include_stdout=True, env=None):
+    # See https://github.com/pyinstaller/pyinstaller/wiki/Recipe-subprocess
+    # for reference and comments.
+
+    kwargs = {
+        'stdin': subprocess.PIPE,
+        'stderr': subprocess.PIPE,
+        'startupinfo': None,
+        'env': environ if env is None else env,
+    }
+
+    if hasattr(subprocess, 'STARTUPINFO'):
+        kwargs['startupinfo'] = subprocess.STARTUPINFO()
+        kwargs['startupinfo'].dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        kwargs['startupinfo'].wShowWindow = subprocess.SW_HIDE
+
+    if include_stdout:
+        kwargs['stdout'] = subprocess.PIPE
+
+    if setsid is not None:
+        # a process group of its own, which is killed on timeouts
+        if sys.version_info[0] < 3:
+            kwargs['preexec_fn'] = setsid
+        else:
+            kwargs['start_new_session'] = True
+
+    return kwargs
+
+
+def split_config(config):
+    """
+    Splits a command line config into its options with their values and its
+    config names. Tesseract takes all arguments after the first config name
+    for config names, so the options have to go first.
+    """
+    options, names = [], []
+    args = iter(shlex.split(config))
+    for arg in args:
+        if arg.startswith('-'):
+            options.append(arg)
+            options.extend(islice(args, 1))
+        else:
+            names.append(arg)
+    return options, names
+
+
+def get_cmd_args(
+    input_filename,
+    output_filename_base,
+    extension,
+    lang,
+    config='',
+    nice=0,
+    cmd=None,
+):
+    cmd_args = []
+
+    if not sys.platform.startswith('win32') and nice != 0:
+        cmd_args += ('nice', '-n', str(nice))
+
+    cmd_args += (cmd or tesseract_cmd, input_filename, output_filename_base)
+
+    if lang is not None:
+        cmd_args += ('-l', lang)
+
+    if config:
+        # config is a string or a list of already split arguments
+        cmd_args += config if isinstance(config, list) else shlex.split(config)
+
+    if extension and extension not in {'box', 'osd', 'tsv'}:
+        cmd_args.append(extension)
+
+    return cmd_args
+
+
+def run_process(cmd_args, timeout=0, input_bytes=None, kwargs=None):
+    """
+    Runs the tesseract command line and returns its stdout.
+    kwargs are the Popen arguments, subprocess_args() by default.
+    timeout is in seconds or a Deadline.
+    """
+    timeout = get_timeout(timeout)
+    started = default_timer()
+    try:
+        with trace_stage('spawn'):
+            proc = RusagePopen(cmd_args, **(kwargs or subprocess_args()))
+    except OSError as e:
+        if e.errno != ENOENT:
+            raise e
+        raise TesseractNotFoundError()
+
+    stage = trace_stage('run')
+    with stage, timeout_manager(proc, timeout, input_bytes) as streams:
+        output, error_string = streams
+        set_usage(proc, default_timer() - started)
+        if proc.returncode:
+            raise TesseractError(proc.returncode, get_errors(error_string))
+        return output
+
+
+def run_tesseract(
+    input_filename,
+    output_filename_base,
+    extension,
+    lang,
+    config='',
+    nice=0,
+    timeout=0,
+    input_bytes=None,
+    env=None,
+    cmd=None,
+):
+    cmd_args = get_cmd_args(
+        input_filename,
+        output_filename_base,
+        extension,
+        lang,
+        config,
+        nice,
+        cmd,
+    )
+    return run_process(
+        cmd_args, timeout, input_bytes, subprocess_args(env=env)
+    )
+
+
+def decode_output(output, return_bytes=False):
+    if return_bytes:
+        return output
+    return output.decode('utf-8').strip()
+
+
+class SubprocessEngine:
+    """
+    Runs the tesseract executable (cmd, tesseract_cmd by default), the default
+    engine. An engine is any object with a run method, which takes the image
+    (file path, PIL image or NumPy array, see prepare), the output extension,
+    lang, config, nice, timeout, transport and env and returns the output
+    bytes. It can be passed as engine to all image_to_* functions or be set
+    as default_engine. Other engines may have the Tesseract version of their
+    outputs as version, they are assumed to be recent otherwise. Temporary
+    files go to directory (or the default temporary directory).
+    """
+
+    def __init__(self, cmd=None, directory=None):
+        self.cmd = cmd
+        self.directory = directory
+
+    def get_cmd_args(
+        self,
+        input_filename,
+        output_filename_base,
+        extension,
+        lang,
+        config='',
+        nice=0,
+    ):
+        return get_cmd_args(
+            input_filename,
+            output_filename_base,
+            extension,
+            lang,
+            config,
+            nice,
+            self.cmd,
+        )
+
+    def subprocess_args(self, env=None):
+        return subprocess_args(env=env)
+
+    def run(
+        self,
+        image,
+        extension,
+        lang=None,
+        config='',
+        nice=0,
+        timeout=0,
+        transport=None,
+        env=None,
+    ):
+        if transport is None:
+            transport = default_transport
+
+        args = [extension, lang, config, nice]
+        kwargs = self.subprocess_args(env)
+
+        if transport == Transport.PIPE and extension in PIPE_EXTENSIONS:
+            input_filename, input_bytes = pipe(image)
+            cmd_args = self.get_cmd_args(input_filename, 'stdout', *args)
+            return run_process(cmd_args, timeout, input_bytes, kwargs)
+
+        saved = save(image, self.directory, [extension])
+        with saved as (temp_name, input_filename):
+            cmd_args = self.get_cmd_args(input_filename, temp_name, *args)
+            run_process(cmd_args, timeout, None, kwargs)
+            with trace_stage('read'):
+                filename = temp_name + extsep + extension
+                with open(filename, 'rb') as output_file:
+                    return output_file.read()
+
+    def save_output(
+        self,
+        image,
+        extension,
+        destination,
+        lang=None,
+        config='',
+        nice=0,
+        timeout=0,
+        env=None,
+    ):
+        """
+        Writes the output to destination, see run_and_save_output.
+        """
+        args = [extension, lang, config, nice]
+        kwargs = self.subprocess_args(env)
+
+        if hasattr(destination, 'write'):
+            saved = save(image, self.directory, [extension])
+            with saved as (temp_name, input_filename):
+                cmd_args = self.get_cmd_args(input_filename, temp_name, *args)
+                run_process(cmd_args, timeout, None, kwargs)
+                filename = temp_name + extsep + extension
+                with open(filename, 'rb') as output_file:
+                    copyfileobj(output_file, destination, OUTPUT_CHUNK_SIZE)
+            return
+
+        # tesseract writes next to the destination, which is then replaced
+        with NamedTemporaryFile(
+            prefix='tess_', dir=dirname(abspath(destination)), delete=False,
+        ) as f:
+            output_filenames = [f.name, f.name + extsep + extension]
+        try:
+            saved = save(image, self.directory)
+            with saved as (temp_name, input_filename):
+                cmd_args = self.get_cmd_args(input_filename, f.name, *args)
+                run_process(cmd_args, timeout, None, kwargs)
+            replace(output_filenames[1], destination)
+        finally:
+            remove_files(output_filenames)
+
+    def run_outputs(
+        self,
+        image,
+        extensions,
+        lang=None,
+        config='',
+        nice=0,
+        timeout=0,
+        env=None,
+    ):
+        """
+        Returns a dict with the output bytes of each of the extensions, which
+        are all written by one tesseract run.
+        """
+        # tesseract takes all arguments after the first config name for
+        # config names, so the -c options go first, like in image_to_data
+        configs = [OUTPUT_CONFIGS[extension] for extension in extensions]
+        options = [value for value in configs if value.startswith('-')]
+        names = [value for value in configs if not value.startswith('-')]
+        config = ' '.join(options + [config.strip()] + names)
+        kwargs = self.subprocess_args(env)
+
+        saved = save(image, self.directory, extensions)
+        with saved as (temp_name, input_filename):
+            cmd_args = self.get_cmd_args(
+                input_filename, temp_name, '', lang, config, nice,
+            )
+            run_process(cmd_args, timeout, None, kwargs)
+            outputs = {}
+            with trace_stage('read'):
+                for extension in extensions:
+                    filename = temp_name + extsep + extension
+                    with open(filename, 'rb') as output_file:
+                        outputs[extension] = output_file.read()
+            return outputs
+
+
+class LibtesseractEngine(SubprocessEngine):
+    """
+    Runs the OCR in-process with libtesseract (see the libtesseract module).
+    Calls which the library doesn't support run the executable. The
+    in-process OCR can't be interrupted, so do calls with a timeout.
+    """
+
+    def run(
+        self,
+        image,
+        extension,
+        lang=None,
+        config='',
+        nice=0,
+        timeout=0,
+        transport=None,
+        env=None,
+    ):
+        if not timeout:
+            from . import libtesseract
+
+            source = image
+            if isinstance(image, EncodedImage):
+                source = image.image
+            with trace_stage('run'):
+                output = libtesseract.run(source, extension, lang, config)
+            if output is not None:
+                return output
+
+        return SubprocessEngine.run(
+            self,
+            image,
+            extension,
+            lang,
+            config,
+            nice,
+            timeout,
+            transport,
+            env,
+        )
+
+
+ENGINES = {
+    Engine.SUBPROCESS: SubprocessEngine(),
+    Engine.LIBTESSERACT: LibtesseractEngine(),
+}
+
+
+def runs_executable(engine):
+    """
+    Returns whether the engine always runs the tesseract executable.
+    """
+    return isinstance(engine, SubprocessEngine) and not isinstance(
+        engine, LibtesseractEngine,
+    )
+
+
+def get_input(image, engine):
+    """
+    Returns the EncodedImage for the engines of this module, which reuse its
+    bytes, and the image it wraps for other engines.
+    """
+    if isinstance(engine, SubprocessEngine):
+        return image
+    return image.image
+
+
+def get_engine(engine=None):
+    """
+    Returns the engine for an engine object or Engine name. None stands for
+    default_engine.
+    """
+    if engine is None:
+        engine = default_engine
+
+    if not isinstance(engine, str):
+        return engine
+
+    if engine not in ENGINES:
+        raise ValueError('Unsupported engine: {}'.format(engine))
+    return ENGINES[engine]
+
+
+class TesseractSession(SubprocessEngine):
+    """
+    Engine for many OCR calls with the same tesseract executable (cmd), lang,
+    config, tessdata_dir and env. The executable and its version are checked
+    once, the config is split once and the temporary files are written to a
+    scratch directory of the session, which close() removes. The image_to_*
+    methods take the arguments of the image_to_* functions. A lang passed to
+    them replaces the lang of the session, a config is added to its config:
+    the options of the session go before it and its config names after it.
+    """
+
+    def __init__(
+        self, cmd=None, lang=None, config='', tessdata_dir=None, env=None,
+    ):
+        cmd = cmd or tesseract_cmd
+        self.version = get_tesseract_version(cmd)
+        directory = mkdtemp(prefix='tess_', dir=get_scratch_dir())
+        SubprocessEngine.__init__(self, cmd, directory)
+
+        self.lang = lang
+        self.env = env
+        self.config_options, self.config_names = split_config(config)
+        if tessdata_dir:
+            self.config_options[:0] = ['--tessdata-dir', tessdata_dir]
+
+        self.cache_args = (
+            (lang,) + tuple(self.config_options) + tuple(self.config_names)
+        )
+        self.split_configs = {'': []}
+        self.kwargs = subprocess_args(env=env)
+
+    def get_cmd_args(
+        self,
+        input_filename,
+        output_filename_base,
+        extension,
+        lang,
+        config='',
+        nice=0,
+    ):
+        if config not in self.split_configs:
+            self.split_configs[config] = shlex.split(config)
+
+        return get_cmd_args(
+            input_filename,
+            output_filename_base,
+            extension,
+            self.lang if lang is None else lang,
+            self.config_options
+            + self.split_configs[config]
+            + self.config_names,
+            nice,
+            self.cmd,
+        )
+
+    def subprocess_args(self, env=None):
+        if env is None:
+            return self.kwargs
+        return subprocess_args(env=env)
+
+    def close(self):
+        rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def image_to_string(self, image, *args, **kwargs):
+        return image_to_string(image, *args, engine=self, **kwargs)
+
+    def image_to_pdf_or_hocr(self, image, *args, **kwargs):
+        return image_to_pdf_or_hocr(image, *args, engine=self, **kwargs)
+
+    def image_to_boxes(self, image, *args, **kwargs):
+        return image_to_boxes(image, *args, engine=self, **kwargs)
+
+    def image_to_data(self, image, *args, **kwargs):
+        return image_to_data(image, *args, engine=self, **kwargs)
+
+    def image_to_osd(self, image, *args, **kwargs):
+        return image_to_osd(image, *args, engine=self, **kwargs)
+
+    def image_to_outputs(self, image, *args, **kwargs):
+        return image_to_outputs(image, *args, engine=self, **kwargs)
+
+
+def add_usage(lang, config):
+    """
+    Adds the Usage of the last run to the usage_stats, if they are set.
+    """
+    usage = get_last_usage()
+    if usage is not None and usage_stats is not None:
+        usage_stats.add(lang, config, usage)
+
+
+@traced
+def run_and_get_output(
+    image,
+    extension='',
+    lang=None,
+    config='',
+    nice=0,
+    timeout=0,
+    return_bytes=False,
+    transport=None,
+    env=None,
+    cache=None,
+    engine=None,
+):
+    """
+    Runs tesseract on the image and returns its output. With the PIPE
+    transport the image is streamed to tesseract's stdin and the result read
+    from its stdout, no temporary files are used. Extensions which tesseract
+    can't write to stdout (e.g. osd) always go through temporary files.
+    With a cache (see OutputCache), tesseract only runs for new images.
+    The engine (an Engine name or object, see SubprocessEngine) runs the OCR.
+    """
+    trace = get_trace()
+    if trace is not None and trace.extension is None:
+        trace.extension, trace.lang, trace.config = extension, lang, config
+
+    cache = get_cache(cache)
+    if cache is not None:
+        usage_state.usage = None
+        image = EncodedImage(image)
+        key = cache_key(image, extension, lang, config, engine)
+        output = cache.get(key)
+        if output is None:
+            output = run_and_get_output(
+                get_input(image, get_engine(engine)),
+                extension,
+                lang,
+                config,
+                nice,
+                timeout,
+                True,
+                transport,
+                env,
+                False,
+                engine,
+            )
+            cache.set(key, output)
+        return decode_output(output, return_bytes)
+
+    usage_state.usage = None
+    output = get_engine(engine).run(
+        image, extension, lang, config, nice, timeout, transport, env,
+    )
+    add_usage(lang, config)
+    if trace is not None:
+        trace.add_size('output_bytes', len(output))
+    return decode_output(output, return_bytes)
+
+
+def run_and_save_output(
+    image,
+    extension,
+    destination,
+    lang=None,
+    config='',
+    nice=0,
+    timeout=0,
+    env=None,
+    engine=None,
+):
+    """
+    Runs tesseract on the image and writes its output to destination, a file
+    path or a writable binary stream, without reading the output into memory.
+    Tesseract writes to a temporary file next to a destination path, which
+    replaces the path, and outputs for streams are copied in chunks.
+    Engines without a save_output method write their output bytes.
+    """
+    trace = get_trace()
+    if trace is not None and trace.extension is None:
+        trace.extension, trace.lang, trace.config = extension, lang, config
+
+    usage_state.usage = None
+    engine = get_engine(engine)
+    args = [image, extension, destination, lang, config, nice, timeout, env]
+    if hasattr(engine, 'save_output'):
+        engine.save_output(*args)
+        add_usage(lang, config)
+        return
+
+    output = engine.run(
+        image, extension, lang, config, nice, timeout, None, env,
+    )
+    add_usage(lang, config)
+    if hasattr(destination, 'write'):
+        destination.write(output)
+        return
+    with open(destination, 'wb') as output_file:
+        output_file.write(output)
+
+
+def run_and_get_outputs(
+    image,
+    extensions,
+    lang=None,
+    config='',
+    nice=0,
+    timeout=0,
+    transport=None,
+    env=None,
+    cache=None,
+    engine=None,
+):
+    """
+    Runs tesseract once on the image and returns a dict with the output bytes
+    of each of the extensions. Outputs are always written to temporary files.
+    Engines without a run_outputs method run once per extension.
+    """
+    trace = get_trace()
+    if trace is not None and trace.extension is None:
+        trace.extension = ' '.join(extensions)
+        trace.lang, trace.config = lang, config
+
+    outputs, keys = {}, {}
+    cache = get_cache(cache)
+    if cache is not None:
+        image = EncodedImage(image)
+        for extension in extensions:
+            keys[extension] = cache_key(image, extension, lang, config, engine)
+            output = cache.get(keys[extension])
+            if output is not None:
+                outputs[extension] = output
+
+    usage_state.usage = None
+    missing = [
+        extension for extension in extensions if extension not in outputs
+    ]
+    if not missing:
+        return outputs
+
+    engine = get_engine(engine)
+    if cache is not None:
+        image = get_input(image, engine)
+    if hasattr(engine, 'run_outputs'):
+        outputs.update(
+            engine.run_outputs(
+                image, missing, lang, config, nice, timeout, env
+            ),
+        )
+    else:
+        for extension in missing:
+            outputs[extension] = engine.run(
+                image, extension, lang, config, nice, timeout, transport, env,
+            )
+    add_usage(lang, config)
+
+    for extension in missing:
+        if trace is not None:
+            trace.add_size('output_bytes', len(outputs[extension]))
+        if cache is not None:
+            cache.set(keys[extension], outputs[extension])
+    return outputs
+
+
+def iter_output(
+    image,
+    extension,
+    lang=None,
+    config='',
+    nice=0,
+    timeout=0,
+    transport=None,
+    env=None,
+    engine=None,
+):
+    """
+    Yields the lines of the tesseract output without reading all of it.
+    With the PIPE transport the lines are yielded as tesseract writes them.
+    Other engines than SubprocessEngine return their output at once.
+    """
+    engine = get_engine(engine)
+    if not runs_executable(engine):
+        output = engine.run(
+            image, extension, lang, config, nice, timeout, transport, env,
+        )
+        for line in BytesIO(output):
+            yield line
+        return
+
+    if transport is None:
+        transport = default_transport
+
+    args = [extension, lang, config, nice]
+    if transport != Transport.PIPE or extension not in PIPE_EXTENSIONS:
+        saved = save(image, engine.directory, [extension])
+        with saved as (temp_name, input_filename):
+            cmd_args = engine.get_cmd_args(input_filename, temp_name, *args)
+            run_process(cmd_args, timeout, None, engine.subprocess_args(env))
+            add_usage(lang, config)
+            with open(temp_name + extsep + extension, 'rb') as output_file:
+                for line in output_file:
+                    yield line
+        return
+
+    input_filename, input_bytes = pipe(image)
+    cmd_args = engine.get_cmd_args(input_filename, 'stdout', *args)
+    with TemporaryFile() as error_file:
+        # stderr goes to a file, so it can't fill up while stdout is read
+        kwargs = dict(engine.subprocess_args(env))
+        kwargs['stderr'] = error_file
+        seconds = get_timeout(timeout)
+        started = default_timer()
+        try:
+            proc = RusagePopen(cmd_args, **kwargs)
         except OSError as e:
             if e.errno != ENOENT:
                 raise e
+            raise TesseractNotFoundError()
 
+        entry = watchdog.watch(proc, seconds) if seconds else None
+        try:
+            try:
+                if input_bytes is not None:
+                    proc.stdin.write(input_bytes)
+                proc.stdin.close()
+            except (IOError, OSError):
+                pass  # tesseract failed, the error is raised below
+
+            for line in proc.stdout:
+                yield line
+            proc.wait()
+        finally:
+            expired = entry is not None and watchdog.cancel(entry)
+            if proc.returncode is None:
+                # the lines haven't all been consumed
+                kill_process(proc)
+                proc.wait()
+            proc.stdout.close()
+            set_usage(proc, default_timer() - started)
+            add_usage(lang, config)
+
+        if expired:
+            raise RuntimeError('Tesseract process timeout')
 
-def prepare(image):
-    if numpy_installed and isinstance(image, ndarray):
-        image = Image.fromarray(image)
+        if proc.returncode:
+            error_file.seek(0)
+            raise TesseractError(
+                proc.returncode, get_errors(error_file.read())
+            )
 
-    if not isinstance(image, Image.Image):
-        raise TypeError('Unsupported image object')
 
-    extension = 'PNG' if not image.format else image.format
-    if extension not in SUPPORTED_FORMATS:
-        raise TypeError('Unsupported image format/type')
+def iter_data(lines, level=None):
+    """
+    Yields the rows of TSV lines (bytes, with a header line) as namedtuples
+    of typed values. If a level (or a collection of levels) is given, the
+    other rows are skipped before their values are parsed.
+    """
+    lines = iter(lines)
+    header = next(lines, b'').decode('utf-8').rstrip('\r\n')
+    if not header:
+        return
 
-    if not image.mode.startswith(RGB_MODE):
-        image = image.convert(RGB_MODE)
+    header = header.split('\t')
+    length = len(header)
+    row_type = namedtuple('DataRow', header, rename=True)
+    parsers = [parser(COLUMN_TYPES.get(head, str)) for head in header]
+
+    levels = None
+    if level is not None:
+        levels = {level} if isinstance(level, int) else set(level)
+        level_idx = header.index('level')
+
+    for line in lines:
+        line = line.decode('utf-8').rstrip('\r\n')
+        if not line:
+            continue
+
+        cells = line.split('\t')
+        if levels is not None and int_cache[cells[level_idx]] not in levels:
+            continue
+
+        if len(cells) < length:
+            cells.extend([''] * (length - len(cells)))
+        yield row_type(*[parse(cell) for parse, cell in zip(parsers, cells)])
+
+
+HocrElement = namedtuple(
+    'HocrElement',
+    [
+        'ocr_class',
+        'id',
+        'parent',
+        'page_num',
+        'left',
+        'top',
+        'width',
+        'height',
+        'baseline',
+        'conf',
+        'text',
+    ],
+)
+HOCR_TEXT_CLASSES = {'ocrx_word', 'ocrx_cinfo'}
+
+
+class LineReader:
+    """
+    Minimal binary file over an iterable of byte strings, for parsers.
+    """
 
-    if 'A' in image.getbands():
-        # discard and replace the alpha channel with white background
-        background = Image.new(RGB_MODE, image.size, (255, 255, 255))
-        background.paste(image, (0, 0), image)
-        image = background
+    def __init__(self, lines):
+        self.lines = iter(lines)
 
-    image.format = extension
-    if 'format' not in image.info:
-        image.info['format'] = extension
+    def read(self, size=-1):
+        for line in self.lines:
+            if line:
+                return line
+        return b''
 
-    return image, extension
 
+def get_ocr_class(classes):
+    for name in classes.split():
+        if name.startswith('ocr'):
+            return name
+    return None
 
-@contextmanager
-def save(image):
-    try:
-        with NamedTemporaryFile(prefix='tess_', delete=False) as f:
-            if isinstance(image, str):
-                yield f.name, realpath(normpath(normcase(image)))
-                return
 
-            image, extension = prepare(image)
-            input_file_name = f.name + extsep + extension
-            image.save(input_file_name, **image.info)
-            yield f.name, input_file_name
-    finally:
-        cleanup(f.name)
+def parse_title(title):
+    """
+    Returns the bbox (left, top, width, height), the baseline (slope,
+    offset) or None and the x_wconf (-1 if missing) of an hOCR title.
+    """
+    properties = {}
+    for prop in title.split(';'):
+        name, _, value = prop.strip().partition(' ')
+        properties[name] = value
 
+    box = (-1, -1, -1, -1)
+    if 'bbox' in properties:
+        left, top, right, bottom = map(int, properties['bbox'].split())
+        box = (left, top, right - left, bottom - top)
 
-def subprocess_args(include_stdout=True):
-    # See https://github.com/pyinstaller/pyinstaller/wiki/Recipe-subprocess
-    # for reference and comments.
+    baseline = None
+    if 'baseline' in properties:
+        baseline = tuple(map(float, properties['baseline'].split()))
 
-    kwargs = {
-        'stdin': subprocess.PIPE,
-        'stderr': subprocess.PIPE,
-        'startupinfo': None,
-        'env': environ,
-    }
+    conf = float(properties.get('x_wconf', -1))
+    return box + (baseline, conf)
 
-    if hasattr(subprocess, 'STARTUPINFO'):
-        kwargs['startupinfo'] = subprocess.STARTUPINFO()
-        kwargs['startupinfo'].dwFlags |= subprocess.STARTF_USESHOWWINDOW
-        kwargs['startupinfo'].wShowWindow = subprocess.SW_HIDE
 
-    if include_stdout:
-        kwargs['stdout'] = subprocess.PIPE
+def iter_hocr(source):
+    """
+    Yields the ocr_* and ocrx_* elements of an hOCR document (bytes, a binary
+    file or an iterable of lines, e.g. of iter_output) as HocrElement tuples
+    in document order. parent is the index of the enclosing element in the
+    sequence (-1 for pages), page_num counts the pages from 1 and text is
+    only set for words and characters. The document is parsed incrementally
+    and parsed elements are discarded, so no DOM of it is built and the
+    memory use doesn't grow with the number of pages.
+    """
+    from xml.etree.ElementTree import iterparse
+
+    if isinstance(source, bytes):
+        source = BytesIO(source)
+    elif not hasattr(source, 'read'):
+        source = LineReader(source)
+
+    rows = deque()  # rows in document order, words wait for their text
+    stack = []  # the open elements with their row (None for other elements)
+    parents = []  # the indexes of the open ocr elements
+    index = page_num = text_depth = 0
+
+    for event, element in iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            ocr_class = get_ocr_class(element.get('class', ''))
+            row = None
+            if ocr_class is not None:
+                page_num += ocr_class == 'ocr_page'
+                parent = parents[-1] if parents else -1
+                is_text = ocr_class in HOCR_TEXT_CLASSES
+                row = [ocr_class, element.get('id', ''), parent, page_num]
+                row.extend(parse_title(element.get('title', '')))
+                row.append(None if is_text else '')
+                rows.append(row)
+                parents.append(index)
+                index += 1
+                text_depth += is_text
+            stack.append((element, row))
+        else:
+            element, row = stack.pop()
+            if row is not None:
+                parents.pop()
+                if row[-1] is None:
+                    row[-1] = ''.join(element.itertext()).strip()
+                    text_depth -= 1
+                if not text_depth:
+                    # words keep their characters until their text is read
+                    element.clear()
+                    if stack:
+                        stack[-1][0].remove(element)
+
+        while rows and rows[0][-1] is not None:
+            yield HocrElement(*rows.popleft())
+
+
+@timed('parse')
+def hocr_to_dict(elements):
+    """
+    Returns a dict with the list of values of each HocrElement field.
+    """
+    columns = [[] for _ in HocrElement._fields]
+    for element in elements:
+        for column, value in zip(columns, element):
+            column.append(value)
+    return dict(zip(HocrElement._fields, columns))
 
-    return kwargs
 
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
 
-def run_tesseract(
-    input_filename,
-    output_filename_base,
-    extension,
-    lang,
-    config='',
-    nice=0,
-    timeout=0,
+
+def run_batch_and_get_output(
+    images, extension, lang, config, nice, timeout, chunk_size, **kwargs
 ):
-    cmd_args = []
+    """
+    Runs tesseract once per chunk of images, passing each chunk as list file.
+    Yields the decoded output of each run with the number of images in it.
+    """
+    kwargs['cache'] = False  # the list file content isn't the images
+    directory = getattr(get_engine(kwargs.get('engine')), 'directory', None)
+    for chunk in chunked(images, chunk_size):
+        with save_batch(chunk, directory) as list_filename:
+            output = run_and_get_output(
+                list_filename,
+                extension,
+                lang,
+                config,
+                nice,
+                timeout,
+                True,
+                **kwargs
+            )
+        yield output.decode('utf-8'), len(chunk)
 
-    if not sys.platform.startswith('win32') and nice != 0:
-        cmd_args += ('nice', '-n', str(nice))
 
-    cmd_args += (tesseract_cmd, input_filename, output_filename_base)
+@timed('parse')
+def split_pages(text, page_count):
+    """
+    Splits the text output of a multi page run on the page separators.
+    Depending on the version tesseract also terminates the last page.
+    """
+    pages = text.split(PAGE_SEPARATOR)
+    if len(pages) == page_count + 1 and not pages[-1].strip():
+        pages.pop()
 
-    if lang is not None:
-        cmd_args += ('-l', lang)
+    if len(pages) != page_count:
+        raise RuntimeError('Failed to split tesseract output into pages')
 
-    if config:
-        cmd_args += shlex.split(config)
+    return [page.strip() for page in pages]
 
-    if extension and extension not in {'box', 'osd', 'tsv'}:
-        cmd_args.append(extension)
 
-    try:
-        proc = subprocess.Popen(cmd_args, **subprocess_args())
-    except OSError as e:
-        if e.errno != ENOENT:
-            raise e
-        raise TesseractNotFoundError()
+@timed('parse')
+def split_tsv(tsv, page_count):
+    """
+    Splits the TSV output of a multi page run on the page_num column.
+    Every part gets the header and its rows renumbered as page 1.
+    """
+    rows = tsv.split('\n')
+    header = rows.pop(0)
+    page_num_idx = header.split('\t').index('page_num')
 
-    with timeout_manager(proc, timeout) as error_string:
-        if proc.returncode:
-            raise TesseractError(proc.returncode, get_errors(error_string))
+    pages = [[header] for _ in range(page_count)]
+    for row in rows:
+        if not row:
+            continue
 
+        cells = row.split('\t')
+        page_num = int(cells[page_num_idx])
+        if not 0 < page_num <= page_count:
+            raise RuntimeError('Failed to split tesseract output into pages')
 
-def run_and_get_output(
-    image,
-    extension='',
-    lang=None,
-    config='',
-    nice=0,
-    timeout=0,
-    return_bytes=False,
-):
-    with save(image) as (temp_name, input_filename):
-        kwargs = {
-            'input_filename': input_filename,
-            'output_filename_base': temp_name,
-            'extension': extension,
-            'lang': lang,
-            'config': config,
-            'nice': nice,
-            'timeout': timeout,
-        }
+        cells[page_num_idx] = '1'
+        pages[page_num - 1].append('\t'.join(cells))
 
-        run_tesseract(**kwargs)
-        filename = kwargs['output_filename_base'] + extsep + extension
-        with open(filename, 'rb') as output_file:
-            if return_bytes:
-                return output_file.read()
-            return output_file.read().decode('utf-8').strip()
+    return ['\n'.join(page) for page in pages]
 
 
-def file_to_dict(tsv, cell_delimiter, str_col_idx):
-    result = {}
-    rows = [row.split(cell_delimiter) for row in tsv.split('\n')]
-    if not rows:
-        return result
+def split_columns(tsv, cell_delimiter):
+    """
+    Returns the header and the columns of the tsv, with the cells as str.
+    Missing cells at the end of a row are empty.
+    """
+    header_str, _, body = tsv.rstrip('\n').partition('\n')
+    if not header_str:
+        return [], []
 
-    header = rows.pop(0)
+    header = header_str.split(cell_delimiter)
     length = len(header)
-    if len(rows[-1]) < length:
+
+    # split all rows at once and slice the columns out of the cells
+    row_count = body.count('\n') + 1 if body else 0
+    cells = body.replace('\n', cell_delimiter).split(cell_delimiter)
+    if len(cells) == row_count * length - 1:
         # Fixes bug that occurs when last text string in TSV is null, and
         # last row is missing a final cell in TSV file
-        rows[-1].append('')
+        cells.append('')
 
-    if str_col_idx < 0:
-        str_col_idx += length
+    if len(cells) == row_count * length:
+        return header, [cells[i::length] for i in range(length)]
+
+    rows = [row.split(cell_delimiter) for row in body.split('\n') if row]
+    for row in rows:
+        if len(row) < length:
+            row.extend([''] * (length - len(row)))
+    return header, list(zip(*rows)) if rows else [()] * length
+
+
+@timed('parse')
+def file_to_dict(tsv, cell_delimiter, str_col_idx):
+    """
+    Returns the columns of the tsv (with a header row) as lists. The values
+    of the known columns (see COLUMN_TYPES) get their type, those of other
+    columns except str_col_idx are converted to int if they are digits.
+    """
+    header, columns = split_columns(tsv, cell_delimiter)
+    column_types = [COLUMN_TYPES.get(head) for head in header]
+    if column_types:
+        column_types[str_col_idx] = str
+
+    return {
+        head: dict_column(values, column_type)
+        for head, values, column_type in zip(header, columns, column_types)
+    }
 
-    for i, head in enumerate(header):
-        result[head] = list()
-        for row in rows:
-            if len(row) <= i:
-                continue
 
-            val = row[i]
-            if row[i].isdigit() and i != str_col_idx:
-                val = int(row[i])
-            result[head].append(val)
+def parser(column_type):
+    return int_cache.__getitem__ if column_type is int else column_type
 
-    return result
+
+def dict_column(values, column_type):
+    if column_type is str:
+        return list(values)
+
+    if column_type in ARRAY_TYPECODES:
+        try:
+            return list(map(parser(column_type), values))
+        except ValueError:
+            pass
+
+    return [int(value) if value.isdigit() else value for value in values]
 
 
 def is_valid(val, _type):
@@ -398,6 +2374,7 @@ def is_valid(val, _type):
     return True
 
 
+@timed('parse')
 def osd_to_dict(osd):
     return {
         OSD_KEYS[kv[0]][0]: OSD_KEYS[kv[0]][1](kv[1])
@@ -406,26 +2383,68 @@ def osd_to_dict(osd):
     }
 
 
-@run_once
-def get_tesseract_version():
+def get_tesseract_version(cmd=None):
     """
-    Returns LooseVersion object of the Tesseract version
+    Returns LooseVersion object of the Tesseract version of cmd
+    (tesseract_cmd by default). Each command is only run once.
     """
-    try:
-        return LooseVersion(
-            subprocess.check_output(
-                [tesseract_cmd, '--version'], stderr=subprocess.STDOUT,
+    cmd = cmd or tesseract_cmd
+    if cmd not in tesseract_versions:
+        # distutils is slow to import, so it's only imported when needed
+        from distutils.version import LooseVersion
+
+        try:
+            tesseract_versions[cmd] = LooseVersion(
+                subprocess.check_output(
+                    [cmd, '--version'], stderr=subprocess.STDOUT,
+                )
+                .decode('utf-8')
+                .split()[1]
+                .lstrip(string.printable[10:]),
             )
-            .decode('utf-8')
-            .split()[1]
-            .lstrip(string.printable[10:]),
-        )
-    except OSError:
-        raise TesseractNotFoundError()
+        except OSError:
+            raise TesseractNotFoundError()
+    return tesseract_versions[cmd]
+
+
+def get_engine_version(engine=None):
+    """
+    Returns the Tesseract version the engine reports as its version, the
+    version of the executable of a SubprocessEngine or None if it's unknown.
+    """
+    engine = get_engine(engine)
+    version = getattr(engine, 'version', None)
+    if version is not None:
+        if isinstance(version, str):
+            # distutils is slow to import, so it's only imported when needed
+            from distutils.version import LooseVersion
+
+            version = LooseVersion(version)
+        return version
 
+    if isinstance(engine, SubprocessEngine):
+        return get_tesseract_version(engine.cmd)
+    return None
 
+
+def engine_older_than(engine, version):
+    """
+    Returns whether the Tesseract version of the engine is older than
+    version. Engines of unknown versions are assumed to be recent.
+    """
+    engine_version = get_engine_version(engine)
+    return engine_version is not None and engine_version < version
+
+
+@traced
 def image_to_string(
-    image, lang=None, config='', nice=0, output_type=Output.STRING, timeout=0,
+    image,
+    lang=None,
+    config='',
+    nice=0,
+    output_type=Output.STRING,
+    timeout=0,
+    **kwargs
 ):
     """
     Returns the result of a Tesseract OCR run on the provided image to string
@@ -433,28 +2452,76 @@ def image_to_string(
     args = [image, 'txt', lang, config, nice, timeout]
 
     return {
-        Output.BYTES: lambda: run_and_get_output(*(args + [True])),
-        Output.DICT: lambda: {'text': run_and_get_output(*args)},
-        Output.STRING: lambda: run_and_get_output(*args),
+        Output.BYTES: lambda: run_and_get_output(*(args + [True]), **kwargs),
+        Output.DICT: lambda: {'text': run_and_get_output(*args, **kwargs)},
+        Output.STRING: lambda: run_and_get_output(*args, **kwargs),
     }[output_type]()
 
 
+@traced
 def image_to_pdf_or_hocr(
-    image, lang=None, config='', nice=0, extension='pdf', timeout=0,
+    image,
+    lang=None,
+    config='',
+    nice=0,
+    extension='pdf',
+    timeout=0,
+    output_type=Output.BYTES,
+    destination=None,
+    **kwargs
 ):
     """
     Returns the result of a Tesseract OCR run on the provided image to pdf/hocr
+    hOCR can be parsed (see iter_hocr) to Output.DICT or Output.ITER, which
+    parses the output while it's read. With a destination (a file path or a
+    writable binary stream) the output is written there instead of being
+    returned, without holding it in memory (see run_and_save_output).
     """
 
     if extension not in {'pdf', 'hocr'}:
         raise ValueError('Unsupported extension: {}'.format(extension))
-    args = [image, extension, lang, config, nice, timeout, True]
+    if extension == 'pdf' and output_type != Output.BYTES:
+        raise ValueError('Unsupported output type for pdf: ' + output_type)
+    args = [image, extension, lang, config, nice, timeout]
+
+    if destination is not None:
+        if output_type != Output.BYTES:
+            raise ValueError('A destination requires Output.BYTES')
+        kwargs.pop('cache', None)  # saved outputs aren't cached
+        kwargs.pop('transport', None)  # tesseract writes to a file
+        return run_and_save_output(
+            image,
+            extension,
+            destination,
+            lang,
+            config,
+            nice,
+            timeout,
+            **kwargs
+        )
+
+    if output_type == Output.ITER:
+        kwargs.pop('cache', None)  # streamed outputs aren't cached
+        return iter_hocr(iter_output(*args, **kwargs))
 
-    return run_and_get_output(*args)
+    return {
+        Output.BYTES: lambda: run_and_get_output(*(args + [True]), **kwargs),
+        Output.DICT: lambda: hocr_to_dict(
+            iter_hocr(run_and_get_output(*(args + [True]), **kwargs)),
+        ),
+        Output.STRING: lambda: run_and_get_output(*args, **kwargs),
+    }[output_type]()
 
 
+@traced
 def image_to_boxes(
-    image, lang=None, config='', nice=0, output_type=Output.STRING, timeout=0,
+    image,
+    lang=None,
+    config='',
+    nice=0,
+    output_type=Output.STRING,
+    timeout=0,
+    **kwargs
 ):
     """
     Returns string containing recognized characters and their box boundaries
@@ -463,19 +2530,22 @@ def image_to_boxes(
     args = [image, 'box', lang, config, nice, timeout]
 
     return {
-        Output.BYTES: lambda: run_and_get_output(*(args + [True])),
+        Output.BYTES: lambda: run_and_get_output(*(args + [True]), **kwargs),
         Output.DICT: lambda: file_to_dict(
-            'char left bottom right top page\n' + run_and_get_output(*args),
+            ' '.join(BOX_HEADER) + '\n' + run_and_get_output(*args, **kwargs),
             ' ',
             0,
         ),
-        Output.STRING: lambda: run_and_get_output(*args),
+        Output.NUMPY: lambda: tsv_to_numpy(
+            run_and_get_output(*(args + [True]), **kwargs), ' ', BOX_HEADER,
+        ),
+        Output.STRING: lambda: run_and_get_output(*args, **kwargs),
     }[output_type]()
 
 
-def get_pandas_output(args, config=None):
-    if not pandas_installed:
-        raise PandasNotSupported()
+@timed('parse')
+def tsv_to_pandas(tsv, config=None):
+    pd = import_pandas()
 
     kwargs = {'quoting': QUOTE_NONE, 'sep': '\t'}
     try:
@@ -483,9 +2553,47 @@ def get_pandas_output(args, config=None):
     except (TypeError, ValueError):
         pass
 
-    return pd.read_csv(BytesIO(run_and_get_output(*args)), **kwargs)
+    return pd.read_csv(BytesIO(tsv), **kwargs)
+
+
+@timed('parse')
+def tsv_to_numpy(tsv, cell_delimiter, header=None):
+    """
+    Parses the tsv bytes into a numpy structured array with a field for each
+    column, typed by COLUMN_TYPES. Unless the header is given, it's read from
+    the first row.
+    """
+    numpy = import_numpy()
+
+    skiprows = 0
+    if header is None:
+        header = tsv.split(b'\n', 1)[0].decode('utf-8').split(cell_delimiter)
+        skiprows = 1
+
+    dtype = [
+        (str(head), NUMPY_TYPES[COLUMN_TYPES.get(head, str)])
+        for head in header
+    ]
+    with catch_warnings():
+        simplefilter('ignore')  # for outputs without any data
+        return numpy.loadtxt(
+            BytesIO(tsv),
+            dtype=dtype,
+            delimiter=cell_delimiter,
+            skiprows=skiprows,
+            comments=None,
+            ndmin=1,
+            encoding='utf-8',
+        )
+
+
+def get_pandas_output(args, config=None, **run_kwargs):
+    import_pandas()  # before running tesseract
 
+    return tsv_to_pandas(run_and_get_output(*args, **run_kwargs), config)
 
+
+@traced
 def image_to_data(
     image,
     lang=None,
@@ -494,47 +2602,432 @@ def image_to_data(
     output_type=Output.STRING,
     timeout=0,
     pandas_config=None,
+    level=None,
+    **kwargs
 ):
     """
     Returns string containing box boundaries, confidences,
     and other information. Requires Tesseract 3.05+
+    Output.ITER returns an iterator over the rows, which are parsed as they
+    are read, optionally only those of the given level(s).
     """
 
-    if get_tesseract_version() < '3.05':
+    if engine_older_than(kwargs.get('engine'), '3.05'):
         raise TSVNotSupported()
 
     config = '{} {}'.format('-c tessedit_create_tsv=1', config.strip()).strip()
     args = [image, 'tsv', lang, config, nice, timeout]
 
+    if output_type == Output.ITER:
+        kwargs.pop('cache', None)  # streamed outputs aren't cached
+        return iter_data(iter_output(*args, **kwargs), level)
+
     return {
-        Output.BYTES: lambda: run_and_get_output(*(args + [True])),
+        Output.BYTES: lambda: run_and_get_output(*(args + [True]), **kwargs),
         Output.DATAFRAME: lambda: get_pandas_output(
-            args + [True], pandas_config,
+            args + [True], pandas_config, **kwargs
+        ),
+        Output.DICT: lambda: file_to_dict(
+            run_and_get_output(*args, **kwargs), '\t', -1,
         ),
-        Output.DICT: lambda: file_to_dict(run_and_get_output(*args), '\t', -1),
-        Output.STRING: lambda: run_and_get_output(*args),
-        Output.OBJECT: lambda: Data(run_and_get_output(*args)),
+        Output.NUMPY: lambda: tsv_to_numpy(
+            run_and_get_output(*(args + [True]), **kwargs), '\t',
+        ),
+        Output.STRING: lambda: run_and_get_output(*args, **kwargs),
+        Output.OBJECT: lambda: Data(run_and_get_output(*args, **kwargs)),
     }[output_type]()
 
 
+@traced
 def image_to_osd(
-    image, lang='osd', config='', nice=0, output_type=Output.STRING, timeout=0,
+    image,
+    lang='osd',
+    config='',
+    nice=0,
+    output_type=Output.STRING,
+    timeout=0,
+    **kwargs
 ):
     """
     Returns string containing the orientation and script detection (OSD)
     """
     config = '{}-psm 0 {}'.format(
-        '' if get_tesseract_version() < '3.05' else '-', config.strip(),
+        '' if engine_older_than(kwargs.get('engine'), '3.05') else '-',
+        config.strip(),
     ).strip()
     args = [image, 'osd', lang, config, nice, timeout]
 
     return {
-        Output.BYTES: lambda: run_and_get_output(*(args + [True])),
-        Output.DICT: lambda: osd_to_dict(run_and_get_output(*args)),
-        Output.STRING: lambda: run_and_get_output(*args),
+        Output.BYTES: lambda: run_and_get_output(*(args + [True]), **kwargs),
+        Output.DICT: lambda: osd_to_dict(run_and_get_output(*args, **kwargs)),
+        Output.STRING: lambda: run_and_get_output(*args, **kwargs),
     }[output_type]()
 
 
+def convert_output(output, extension, output_type, pandas_config=None):
+    """
+    Converts the output bytes of the extension to the output_type, like the
+    image_to_* function of the extension does. pdf stays bytes.
+    """
+    if extension == 'pdf':
+        return output
+
+    return {
+        'box': {
+            Output.BYTES: lambda: output,
+            Output.DICT: lambda: file_to_dict(
+                ' '.join(BOX_HEADER) + '\n' + decode_output(output), ' ', 0,
+            ),
+            Output.NUMPY: lambda: tsv_to_numpy(output, ' ', BOX_HEADER),
+            Output.STRING: lambda: decode_output(output),
+        },
+        'hocr': {
+            Output.BYTES: lambda: output,
+            Output.DICT: lambda: hocr_to_dict(iter_hocr(output)),
+            Output.STRING: lambda: decode_output(output),
+        },
+        'tsv': {
+            Output.BYTES: lambda: output,
+            Output.DATAFRAME: lambda: tsv_to_pandas(output, pandas_config),
+            Output.DICT: lambda: file_to_dict(decode_output(output), '\t', -1),
+            Output.NUMPY: lambda: tsv_to_numpy(output, '\t'),
+            Output.STRING: lambda: decode_output(output),
+            Output.OBJECT: lambda: Data(decode_output(output)),
+        },
+        'txt': {
+            Output.BYTES: lambda: output,
+            Output.DICT: lambda: {'text': decode_output(output)},
+            Output.STRING: lambda: decode_output(output),
+        },
+    }[extension][output_type]()
+
+
+@traced
+def image_to_outputs(
+    image,
+    formats=('txt', 'tsv', 'pdf'),
+    lang=None,
+    config='',
+    nice=0,
+    output_types=None,
+    timeout=0,
+    pandas_config=None,
+    **kwargs
+):
+    """
+    Returns a dict with the output of each of the formats (box, hocr, pdf, tsv
+    and txt) of one Tesseract OCR run on the provided image, instead of a run
+    per image_to_* call. output_types maps formats to the Output type they
+    are converted to, like image_to_string, image_to_data, image_to_boxes
+    and image_to_pdf_or_hocr do (Output.STRING by default, Output.BYTES for
+    hocr and pdf).
+    Box outputs are recognized without batch.nochop, unlike image_to_boxes.
+    """
+    for extension in formats:
+        if extension not in OUTPUT_CONFIGS:
+            raise ValueError('Unsupported format: {}'.format(extension))
+
+    if 'tsv' in formats and engine_older_than(kwargs.get('engine'), '3.05'):
+        raise TSVNotSupported()
+
+    output_types = output_types or {}
+    if Output.DATAFRAME in output_types.values():
+        import_pandas()  # before running tesseract
+
+    args = [image, list(formats), lang, config, nice, timeout]
+    outputs = run_and_get_outputs(*args, **kwargs)
+    return {
+        extension: convert_output(
+            outputs[extension],
+            extension,
+            output_types.get(
+                extension,
+                Output.BYTES
+                if extension in {'hocr', 'pdf'}
+                else Output.STRING,
+            ),
+            pandas_config,
+        )
+        for extension in formats
+    }
+
+
+@traced
+def images_to_string(
+    images,
+    lang=None,
+    config='',
+    nice=0,
+    output_type=Output.STRING,
+    timeout=0,
+    chunk_size=BATCH_CHUNK_SIZE,
+    **kwargs
+):
+    """
+    Returns a list with the result of a Tesseract OCR run on each of the
+    provided images, in input order. The images are processed chunk_size at
+    a time, with one tesseract run for each chunk. Paths of multi-frame
+    images (e.g. TIFF) raise a ValueError, see iter_pages.
+    """
+    convert = {
+        Output.BYTES: lambda page: page.encode('utf-8'),
+        Output.DICT: lambda page: {'text': page},
+        Output.STRING: lambda page: page,
+    }[output_type]
+
+    args = [images, 'txt', lang, config, nice, timeout, chunk_size]
+    return [
+        convert(page)
+        for output, page_count in run_batch_and_get_output(*args, **kwargs)
+        for page in split_pages(output, page_count)
+    ]
+
+
+@traced
+def image_to_string_regions(
+    image,
+    boxes,
+    lang=None,
+    config='',
+    nice=0,
+    output_type=Output.STRING,
+    timeout=0,
+    config_per_box=None,
+    chunk_size=BATCH_CHUNK_SIZE,
+    **kwargs
+):
+    """
+    Returns a list with the image_to_string result of each of the
+    (left, top, right, bottom) boxes of the image, in input order.
+    The image is decoded and prepared once, and the crops sharing a config
+    are OCRed chunk_size at a time, with one tesseract run for each chunk.
+    config_per_box holds an additional config (e.g. '--psm 7') for each box.
+    """
+    if isinstance(image, str):
+        with Image.open(image) as opened:
+            return image_to_string_regions(
+                opened,
+                boxes,
+                lang,
+                config,
+                nice,
+                output_type,
+                timeout,
+                config_per_box,
+                chunk_size,
+                **kwargs
+            )
+
+    image, _ = prepare(image)
+    if config_per_box is None:
+        config_per_box = [''] * len(boxes)
+    elif len(config_per_box) != len(boxes):
+        raise ValueError('config_per_box must have a config for each box')
+
+    groups = OrderedDict()
+    for index, box_config in enumerate(config_per_box):
+        box_config = '{} {}'.format(config, box_config or '').strip()
+        groups.setdefault(box_config, []).append(index)
+
+    results = [None] * len(boxes)
+    for box_config, indexes in groups.items():
+        regions = []
+        for index in indexes:
+            region = image.crop(boxes[index])
+            # the crops are saved in the intermediate format, not the source
+            region.info.clear()
+            regions.append(region)
+
+        args = [regions, lang, box_config, nice, output_type, timeout]
+        for index, result in zip(
+            indexes, images_to_string(*args, chunk_size=chunk_size, **kwargs),
+        ):
+            results[index] = result
+
+    return results
+
+
+@traced
+def images_to_data(
+    images,
+    lang=None,
+    config='',
+    nice=0,
+    output_type=Output.STRING,
+    timeout=0,
+    pandas_config=None,
+    chunk_size=BATCH_CHUNK_SIZE,
+    **kwargs
+):
+    """
+    Returns a list with the image_to_data result of each of the provided
+    images, in input order. The images are processed chunk_size at a time,
+    with one tesseract run for each chunk. Paths of multi-frame images (e.g.
+    TIFF) raise a ValueError, see iter_pages. Requires Tesseract 3.05+
+    """
+
+    if engine_older_than(kwargs.get('engine'), '3.05'):
+        raise TSVNotSupported()
+
+    if output_type == Output.DATAFRAME:
+        import_pandas()  # before running tesseract
+
+    convert = {
+        Output.BYTES: lambda page: page.encode('utf-8'),
+        Output.DATAFRAME: lambda page: tsv_to_pandas(
+            page.encode('utf-8'), pandas_config,
+        ),
+        Output.DICT: lambda page: file_to_dict(page, '\t', -1),
+        Output.NUMPY: lambda page: tsv_to_numpy(page.encode('utf-8'), '\t'),
+        Output.STRING: lambda page: page,
+        Output.OBJECT: lambda page: Data(page),
+    }[output_type]
+
+    config = '{} {}'.format('-c tessedit_create_tsv=1', config.strip()).strip()
+    args = [images, 'tsv', lang, config, nice, timeout, chunk_size]
+    return [
+        convert(page)
+        for output, page_count in run_batch_and_get_output(*args, **kwargs)
+        for page in split_tsv(output, page_count)
+    ]
+
+
+def map_images(
+    images,
+    func='image_to_string',
+    workers=None,
+    ordered=True,
+    return_exceptions=True,
+    omp_thread_limit=None,
+    **kwargs
+):
+    """
+    Runs func (an image_to_* function or its name) on each of the images with
+    a pool of workers running tesseract processes concurrently.
+    OMP_THREAD_LIMIT of the tesseract processes defaults to the number of
+    cores divided by the number of workers, so that the cores aren't
+    oversubscribed. Results are yielded in input order, or as (index, result)
+    pairs as they complete when ordered is False. The exception of a failed
+    image is yielded in place of its result, so that it doesn't stop the
+    other images; if return_exceptions is unset, it is raised instead, which
+    ends the iteration.
+    """
+    if not callable(func):
+        if func not in MAP_FUNCTIONS:
+            raise ValueError('Unsupported function: {}'.format(func))
+        func = globals()[func]
+
+    cores = cpu_count()
+    workers = workers or cores
+    if omp_thread_limit is None:
+        omp_thread_limit = max(1, cores // workers)
+
+    env = dict(kwargs.pop('env', None) or environ)
+    env['OMP_THREAD_LIMIT'] = str(omp_thread_limit)
+    kwargs['env'] = env
+    return iter_map_results(
+        images, func, workers, ordered, return_exceptions, kwargs,
+    )
+
+
+def iter_map_results(
+    images, func, workers, ordered, return_exceptions, kwargs
+):
+    tasks, done = Queue(), Queue()
+    stopped = []
+
+    def work():
+        for index, image in iter(tasks.get, None):
+            if stopped:
+                continue
+            try:
+                done.put((index, func(image, **kwargs), None))
+            except Exception as e:
+                done.put((index, None, e))
+
+    def get_result(result, error):
+        if error is None:
+            return result
+        if return_exceptions:
+            return error
+        raise error
+
+    threads = [Thread(target=work) for _ in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    # bound the number of queued and buffered images, so images may be a
+    # lazy iterable
+    window = 2 * workers
+    images = enumerate(images)
+    pending, finished, next_index = 0, {}, 0
+    try:
+        while True:
+            while pending + len(finished) < window:
+                task = next(images, None)
+                if task is None:
+                    break
+                tasks.put(task)
+                pending += 1
+            if not pending:
+                break
+
+            index, result, error = done.get()
+            pending -= 1
+            if not ordered:
+                yield index, get_result(result, error)
+                continue
+
+            finished[index] = result, error
+            while next_index in finished:
+                yield get_result(*finished.pop(next_index))
+                next_index += 1
+    finally:
+        # the running calls finish, the queued images are skipped
+        stopped.append(True)
+        for thread in threads:
+            tasks.put(None)
+        for thread in threads:
+            thread.join()
+
+
+def iter_frames(image):
+    """
+    Yields the frames of a multi-frame image (or image path) one at a time,
+    so that only the frames which are still referenced are held in memory.
+    """
+    if isinstance(image, str):
+        with Image.open(image) as opened:
+            for frame in iter_frames(opened):
+                yield frame
+        return
+
+    if not isinstance(image, Image.Image):
+        yield image
+        return
+
+    for index in range(getattr(image, 'n_frames', 1)):
+        image.seek(index)
+        yield image.copy()
+
+
+def iter_pages(
+    image, func='image_to_string', workers=None, ordered=False, **kwargs
+):
+    """
+    Runs func (an image_to_* function or its name) on each frame of a
+    multi-frame image (e.g. TIFF or GIF) with map_images and yields
+    (page_index, result) pairs as the pages complete, or in page order if
+    ordered is set. Frames are decoded lazily, so only a window of them is
+    held at once.
+    """
+    results = map_images(
+        iter_frames(image), func, workers, ordered=ordered, **kwargs
+    )
+    return enumerate(results) if ordered else results
+
+
 def main():
     if len(sys.argv) == 2:
         filename, lang = sys.argv[1], None
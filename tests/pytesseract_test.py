@@ -1,31 +1,69 @@
 # encoding: utf-8
+from errno import EPERM
 from glob import iglob
+from io import BytesIO
 from multiprocessing import Pool
-from os import getcwd, path, sep
-from sys import platform, version_info
-from tempfile import gettempdir
+from os import getcwd, getpid, listdir, pardir, path, rename, sep
+from subprocess import check_output
+from sys import executable, platform, version_info
+from threading import current_thread, local
+from time import sleep
 
 import pytest
 from pytesseract import (
     Data,
     DataLine,
+    Deadline,
+    Engine,
     Output,
+    OutputCache,
+    SubprocessEngine,
+    TesseractError,
     TesseractNotFoundError,
+    TesseractSession,
+    Trace,
+    UsageStats,
+    Transport,
     TSVNotSupported,
+    get_last_usage,
     get_tesseract_version,
     image_to_boxes,
     image_to_data,
     image_to_osd,
+    image_to_outputs,
     image_to_pdf_or_hocr,
     image_to_string,
+    image_to_string_regions,
+    images_to_data,
+    images_to_string,
+    iter_hocr,
+    iter_pages,
+    map_images,
+    tracing,
+)
+from pytesseract.libtesseract import parse_config
+from pytesseract.pytesseract import (
+    file_to_dict,
+    get_filename,
+    get_scratch_dir,
+    prepare,
+    run_process,
+    sweep,
 )
-from pytesseract.pytesseract import numpy_installed, pandas_installed, prepare
 
-if numpy_installed:
+try:
     import numpy as np
+except ImportError:
+    numpy_installed = False
+else:
+    numpy_installed = True
 
-if pandas_installed:
+try:
     import pandas
+except ImportError:
+    pandas_installed = False
+else:
+    pandas_installed = True
 
 try:
     from PIL import Image
@@ -102,7 +140,7 @@ def test_image_to_string_with_args_type(test_file):
     assert 'The quick brown dog' in image_to_string(test_file, 'eng')
 
     # Test cleanup of temporary files
-    for _ in iglob(gettempdir() + sep + 'tess_*'):
+    for _ in iglob(get_scratch_dir() + sep + 'tess_*'):
         assert False, 'Failed to cleanup temporary files'
 
 
@@ -126,6 +164,98 @@ def test_image_to_string_batch():
     assert 'The quick brown dog' in image_to_string(batch_file)
 
 
+@pytest.mark.parametrize('chunk_size', [1, 2, 100])
+def test_images_to_string(test_file, test_file_european, chunk_size):
+    images = [test_file, Image.open(test_file_european), Image.open(test_file)]
+    result = images_to_string(images, 'eng', chunk_size=chunk_size)
+
+    assert len(result) == len(images)
+    assert 'The quick brown dog' in result[0]
+    assert 'The quick brown dog' not in result[1]
+    assert 'The quick brown dog' in result[2]
+
+    for _ in iglob(get_scratch_dir() + sep + 'tess_*'):
+        assert False, 'Failed to cleanup temporary files'
+
+
+def test_images_to_string_multi_frame(tmpdir, test_file):
+    multi_page = str(tmpdir.join('multi_page.tiff'))
+    with Image.open(test_file) as image:
+        image.save(multi_page, save_all=True, append_images=[image])
+
+    with pytest.raises(ValueError):
+        images_to_string([test_file, multi_page])
+    for _ in iglob(get_scratch_dir() + sep + 'tess_*'):
+        assert False, 'Failed to cleanup temporary files'
+
+
+@pytest.mark.skipif(
+    TESSERACT_VERSION[:2] < (3, 5), reason='requires tesseract >= 3.05',
+)
+def test_images_to_data(test_file, test_file_european):
+    images = [test_file, test_file_european, test_file]
+    result = images_to_data(images, chunk_size=2, output_type=Output.DICT)
+
+    assert len(result) == len(images)
+    for data in result:
+        assert set(data['page_num']) == {1}
+    assert 'dog' in result[0]['text']
+    assert 'dog' not in result[1]['text']
+    assert result[0]['text'] == result[2]['text']
+
+
+def test_scratch_dir(monkeypatch, tmpdir, test_file):
+    monkeypatch.setattr('pytesseract.pytesseract.scratch_dir', str(tmpdir))
+    stale = tmpdir.join('tess_stale')
+    stale.write('')
+    stale.setmtime(0)
+    fresh = tmpdir.join('tess_fresh')
+    fresh.write('')
+    killed = tmpdir.mkdir('pytesseract_999999999')  # a pid above pid_max
+    killed.setmtime(0)
+    recent = tmpdir.mkdir('pytesseract_999999998')  # e.g. of a container
+
+    image = Image.open(test_file)
+    assert 'The quick brown dog' in image_to_string(image, cache=False)
+    assert len(images_to_string([image, image], chunk_size=2)) == 2
+
+    # only the files of the calls are removed from the process directory
+    assert tmpdir.join('pytesseract_{}'.format(getpid())).listdir() == []
+    assert not stale.check()
+    assert fresh.check()
+    assert not killed.check()
+    assert recent.check()
+
+
+@pytest.mark.skipif(platform.startswith('win32'), reason='requires fork')
+def test_scratch_dir_of_forked_child():
+    import atexit
+    from os import _exit, fork, waitpid
+
+    directory = get_scratch_dir()
+    child = fork()
+    if child == 0:
+        # a child exiting normally runs the inherited exit handlers
+        atexit._run_exitfuncs()
+        _exit(0)
+
+    waitpid(child, 0)
+    assert path.isdir(directory)
+
+
+def test_sweep_skips_entries_of_other_users(monkeypatch, tmpdir):
+    stale = tmpdir.join('tess_stale')
+    stale.write('')
+    stale.setmtime(0)
+
+    def remove(filename):
+        raise OSError(EPERM, 'Operation not permitted', filename)
+
+    monkeypatch.setattr('pytesseract.pytesseract.remove', remove)
+    sweep(str(tmpdir))
+    assert stale.check()
+
+
 def test_image_to_string_multiprocessing():
     """Test parallel system calls."""
     test_files = [
@@ -145,11 +275,381 @@ def test_image_to_string_multiprocessing():
     p.join()
 
 
+@pytest.mark.parametrize(
+    'transport', [Transport.FILE, Transport.PIPE], ids=['file', 'pipe'],
+)
+@pytest.mark.parametrize(
+    'test_file',
+    [TEST_JPEG, Image.open(TEST_JPEG)],
+    ids=['path_str', 'image_object'],
+)
+def test_image_to_string_transport(test_file, transport):
+    result = image_to_string(test_file, 'eng', transport=transport)
+    assert 'The quick brown dog' in result
+
+    # The pipe transport must not leave any temporary files behind
+    for _ in iglob(get_scratch_dir() + sep + 'tess_*'):
+        assert False, 'Failed to cleanup temporary files'
+
+
+@pytest.mark.parametrize(
+    'engine',
+    [Engine.SUBPROCESS, Engine.LIBTESSERACT],
+    ids=['subprocess', 'libtesseract'],
+)
+def test_image_to_string_engine(test_file, engine):
+    # the libtesseract engine falls back to the executable without library
+    for image in test_file, Image.open(test_file):
+        assert 'The quick brown dog' in image_to_string(image, engine=engine)
+
+
+class FakeEngine:
+    outputs = {
+        'txt': b'fake text\n',
+        'tsv': b'level\tconf\ttext\n1\t-1\t\n5\t90\tfake\n',
+    }
+
+    def __init__(self):
+        self.calls = []
+
+    def run(self, image, extension, lang=None, config='', *args):
+        self.calls.append((extension, lang))
+        return self.outputs[extension]
+
+
+def test_custom_engine(monkeypatch, test_file):
+    engine = FakeEngine()
+    assert image_to_string(test_file, 'fra', engine=engine) == 'fake text'
+    assert engine.calls == [('txt', 'fra')]
+
+    # the engine doesn't need the tesseract executable for its version
+    monkeypatch.setattr('pytesseract.pytesseract.tesseract_cmd', 'wrong')
+    monkeypatch.setattr('pytesseract.pytesseract.default_engine', engine)
+    data = image_to_data(test_file, output_type=Output.DICT)
+    assert data == {'level': [1, 5], 'conf': [-1, 90], 'text': ['', 'fake']}
+    assert image_to_string(test_file, cache=OutputCache()) == 'fake text'
+
+    engine.version = '3.02'
+    with pytest.raises(TSVNotSupported):
+        image_to_data(test_file)
+    monkeypatch.undo()
+
+    with pytest.raises(ValueError):
+        image_to_string(test_file, engine='unsupported')
+
+    with pytest.raises(TesseractNotFoundError):
+        image_to_string(test_file, engine=SubprocessEngine('wrong_tesseract'))
+
+
+def test_tesseract_session(test_file):
+    with TesseractSession(lang='eng', config='--psm 3') as session:
+        assert path.isdir(session.directory)
+        cmd_args = session.get_cmd_args('in', 'out', 'txt', None, '--oem 1')
+        assert cmd_args[1:] == [
+            'in',
+            'out',
+            '-l',
+            'eng',
+            '--psm',
+            '3',
+            '--oem',
+            '1',
+            'txt',
+        ]
+
+        assert 'The quick brown dog' in session.image_to_string(test_file)
+        data = session.image_to_data(
+            Image.open(test_file), output_type=Output.DICT,
+        )
+        assert 'dog' in data['text']
+        assert session.image_to_osd(test_file, output_type=Output.DICT)
+
+    assert not path.exists(session.directory)
+
+    with pytest.raises(TesseractNotFoundError):
+        TesseractSession(cmd='wrong_tesseract')
+
+
+def test_tesseract_session_config_names(test_file):
+    with TesseractSession(config='digits --psm 6') as session:
+        cmd_args = session.get_cmd_args(
+            'in', 'out', 'tsv', None, '-c tessedit_create_tsv=1',
+        )
+        assert cmd_args[3:] == [
+            '--psm',
+            '6',
+            '-c',
+            'tessedit_create_tsv=1',
+            'digits',
+        ]
+        assert 'text' in session.image_to_data(
+            test_file, output_type=Output.DICT,
+        )
+
+
+def test_libtesseract_parse_config():
+    options = parse_config(
+        '--psm 6 --oem 1 -c tessedit_char_whitelist=0123456789 hocr',
+    )
+    assert options['psm'] == 6
+    assert options['oem'] == 1
+    assert options['variables'] == [['tessedit_char_whitelist', '0123456789']]
+    assert options['configs'] == ['hocr']
+
+    assert parse_config('--unsupported-option') is None
+    assert parse_config('--psm') is None
+
+
+def test_libtesseract_library_path(monkeypatch):
+    from pytesseract import libtesseract
+
+    opened = []
+    monkeypatch.setattr(libtesseract, 'libraries', {})
+    monkeypatch.setattr(libtesseract, 'open_library', opened.append)
+    for library_path in ('missing', 'missing', 'libtesseract.so.5'):
+        monkeypatch.setattr(libtesseract, 'library_path', library_path)
+        assert libtesseract.load_library() is None
+    assert opened == ['missing', 'libtesseract.so.5']
+
+
+def test_libtesseract_handle_pool(monkeypatch, test_file):
+    from pytesseract import libtesseract
+
+    closed = []
+
+    class Handle:
+        def __init__(self, library, lang, options):
+            self.lang = lang
+
+        def close(self):
+            closed.append(self.lang)
+
+    monkeypatch.setattr(libtesseract, 'Handle', Handle)
+    monkeypatch.setattr(libtesseract, 'max_handles', 2)
+    monkeypatch.setattr(libtesseract, 'pool', local())
+    handles = [
+        libtesseract.get_handle(None, lang, '', None)
+        for lang in ('eng', 'deu', 'eng', 'fra')
+    ]
+    assert handles[0] is handles[2]
+    assert closed == ['deu']
+    assert list(libtesseract.pool.handles) == [('eng', ''), ('fra', '')]
+
+    with Image.open(test_file) as image:
+        assert libtesseract.get_pixels(test_file)[1:3] == image.size
+
+
+def test_default_transport(monkeypatch, test_file):
+    monkeypatch.setattr(
+        'pytesseract.pytesseract.default_transport', Transport.PIPE,
+    )
+    assert 'The quick brown dog' in image_to_string(test_file, 'eng')
+    # osd can't be written to stdout and falls back to temporary files
+    assert 'Script:' in image_to_osd(test_file)
+
+
+@pytest.mark.parametrize(
+    'ordered', [True, False], ids=['ordered', 'completed']
+)
+def test_map_images(test_file, test_invalid_file, ordered):
+    images = [test_file, test_invalid_file, Image.open(test_file)] * 2
+    results = list(map_images(images, workers=2, ordered=ordered))
+    if not ordered:
+        assert sorted(index for index, _ in results) == list(range(6))
+        results = [result for _, result in sorted(results)]
+
+    assert len(results) == len(images)
+    for index, result in enumerate(results):
+        if images[index] is test_invalid_file:
+            assert isinstance(result, TesseractError)
+        else:
+            assert 'The quick brown dog' in result
+
+
+def test_map_images_raises(test_file, test_invalid_file):
+    with pytest.raises(ValueError):
+        map_images([test_file], func='image_to_nothing')
+
+    results = map_images(
+        [test_file, test_invalid_file, test_file],
+        workers=2,
+        return_exceptions=False,
+    )
+    assert 'The quick brown dog' in next(results)
+    with pytest.raises(TesseractError):
+        next(results)
+
+
+def test_image_to_string_regions(test_file):
+    with Image.open(test_file) as image:
+        width, height = image.size
+    boxes = [(0, 0, width, height)] * 3
+
+    results = image_to_string_regions(
+        test_file, boxes, config_per_box=[None, '--psm 6', None],
+    )
+    assert len(results) == len(boxes)
+    for result in results:
+        assert 'The quick brown dog' in result
+
+    results = image_to_string_regions(
+        Image.open(test_file), boxes[:1], output_type=Output.DICT,
+    )
+    assert 'The quick brown dog' in results[0]['text']
+
+    with pytest.raises(ValueError):
+        image_to_string_regions(test_file, boxes, config_per_box=[''])
+
+
+@pytest.mark.parametrize(
+    'ordered', [True, False], ids=['ordered', 'completed']
+)
+def test_iter_pages(tmpdir, test_file, ordered):
+    multi_page = str(tmpdir.join('multi_page.tiff'))
+    with Image.open(test_file) as image:
+        image.save(multi_page, save_all=True, append_images=[image, image])
+
+    results = list(iter_pages(multi_page, workers=2, ordered=ordered))
+    assert sorted(index for index, _ in results) == [0, 1, 2]
+    if ordered:
+        assert [index for index, _ in results] == [0, 1, 2]
+    for _, result in results:
+        assert 'The quick brown dog' in result
+
+    pages = iter_pages(
+        Image.open(multi_page), 'image_to_data', output_type=Output.DICT,
+    )
+    for _, result in pages:
+        assert 'dog' in result['text']
+
+
+@pytest.mark.skipif(IS_PYTHON_2, reason='requires asyncio')
+def test_aio_image_to_string(test_file):
+    import asyncio
+    from pytesseract import aio
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    semaphore = asyncio.Semaphore(2)
+    try:
+        text, image_text, data, osd = loop.run_until_complete(
+            asyncio.gather(
+                aio.image_to_string(test_file, semaphore=semaphore),
+                aio.image_to_string(
+                    Image.open(test_file), semaphore=semaphore
+                ),
+                aio.image_to_data(test_file, output_type=Output.DICT),
+                aio.image_to_osd(test_file, output_type=Output.DICT),
+            ),
+        )
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+    assert 'The quick brown dog' in text
+    assert 'The quick brown dog' in image_text
+    assert 'dog' in data['text']
+    assert 'script' in osd
+
+
+@pytest.mark.skipif(IS_PYTHON_2, reason='requires asyncio')
+def test_aio_prepares_in_executor(monkeypatch, tmpdir, test_file):
+    import asyncio
+    from pytesseract import aio
+
+    threads = []
+
+    def recording_prepare(image):
+        threads.append(current_thread())
+        return prepare(image)
+
+    def recording_get_tesseract_version(cmd=None):
+        threads.append(current_thread())
+        return get_tesseract_version(cmd)
+
+    monkeypatch.setattr('pytesseract.pytesseract.prepare', recording_prepare)
+    monkeypatch.setattr(
+        'pytesseract.pytesseract.get_tesseract_version',
+        recording_get_tesseract_version,
+    )
+    with Image.open(test_file) as image:
+        image = image.convert('L')
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        texts = loop.run_until_complete(
+            asyncio.gather(
+                aio.image_to_string(image, cache=False),
+                aio.image_to_string(
+                    image, cache=False, transport=Transport.PIPE,
+                ),
+                aio.image_to_string(
+                    image, cache=OutputCache(directory=str(tmpdir)),
+                ),
+                aio.image_to_osd(test_file, cache=False),
+            ),
+        )
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+    assert all('The quick brown dog' in text for text in texts[:3])
+    assert 'Script' in texts[3]
+    # prepare runs 3 times, the version is looked up by 2 calls
+    assert len(threads) == 5
+    assert current_thread() not in threads
+
+
+@pytest.mark.skipif(IS_PYTHON_2, reason='requires asyncio')
+def test_aio_image_to_string_timeout(test_file):
+    import asyncio
+    from pytesseract import aio
+
+    loop = asyncio.new_event_loop()
+    try:
+        with pytest.raises(RuntimeError):
+            loop.run_until_complete(
+                aio.image_to_string(test_file, timeout=0.000000001),
+            )
+    finally:
+        loop.close()
+
+
 def test_image_to_string_timeout(test_file):
     with pytest.raises(RuntimeError):
         image_to_string(test_file, timeout=0.000000001)
 
 
+@pytest.mark.skipif(
+    platform.startswith('win32'), reason='requires process groups',
+)
+def test_timeout_kills_process_group(monkeypatch, tmpdir, test_file):
+    marker = tmpdir.join('marker')
+    script = tmpdir.join('tesseract')
+    script.write('#!/bin/sh\n(sleep 0.5; touch {}) &\nwait\n'.format(marker),)
+    script.chmod(0o755)
+    monkeypatch.setattr('pytesseract.pytesseract.tesseract_cmd', str(script))
+
+    with pytest.raises(RuntimeError):
+        image_to_string(test_file, timeout=0.1, cache=False)
+    sleep(0.8)
+    assert not marker.check()
+
+
+def test_deadline(test_file):
+    deadline = Deadline(60)
+    assert 0 < deadline.remaining() <= 60
+    assert len(images_to_string([test_file] * 2, timeout=deadline)) == 2
+
+    expired = Deadline(0)
+    with pytest.raises(RuntimeError):
+        image_to_string(test_file, timeout=expired, cache=False)
+    results = list(map_images([test_file] * 2, timeout=expired, cache=False))
+    assert len(results) == 2
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
 def test_image_to_boxes(test_file):
     result = image_to_boxes(test_file)
     assert isinstance(result, string_type)
@@ -181,6 +681,87 @@ def test_image_to_osd(test_file):
         assert key + ':' in result
 
 
+@pytest.mark.skipif(
+    TESSERACT_VERSION[:2] < (3, 5), reason='requires tesseract >= 3.05',
+)
+def test_image_to_outputs(monkeypatch, tmpdir, test_file):
+    stats = UsageStats()
+    monkeypatch.setattr('pytesseract.pytesseract.usage_stats', stats)
+    cache = OutputCache(directory=str(tmpdir))
+    outputs = image_to_outputs(
+        test_file,
+        ('txt', 'tsv', 'pdf', 'box'),
+        output_types={'tsv': Output.OBJECT, 'box': Output.DICT},
+        cache=cache,
+    )
+    assert [entry['runs'] for entry in stats.dump()] == [1]
+    assert sorted(outputs) == ['box', 'pdf', 'tsv', 'txt']
+    assert outputs['txt'] == image_to_string(test_file)
+    assert isinstance(outputs['tsv'], Data)
+    assert outputs['pdf'].startswith(b'%PDF-')
+    assert 'char' in outputs['box']
+
+    # the outputs are cached one by one
+    assert cache.stats()['misses'] == 4
+    outputs = image_to_outputs(test_file, ('txt', 'hocr'), cache=cache)
+    assert cache.stats()['memory_hits'] == 1
+    assert cache.stats()['misses'] == 5
+    assert isinstance(outputs['hocr'], bytes)
+
+    with pytest.raises(ValueError):
+        image_to_outputs(test_file, ('txt', 'osd'))
+
+
+@pytest.mark.skipif(
+    TESSERACT_VERSION[:2] < (3, 5), reason='requires tesseract >= 3.05',
+)
+def test_image_to_outputs_args(monkeypatch, test_file):
+    cmd_args = []
+
+    def recording_run_process(args, *rest):
+        cmd_args.extend(args)
+        return run_process(args, *rest)
+
+    monkeypatch.setattr(
+        'pytesseract.pytesseract.run_process', recording_run_process,
+    )
+    image_to_outputs(test_file, ('txt', 'tsv', 'pdf'), config='--psm 6')
+    assert cmd_args[-6:] == [
+        '-c',
+        'tessedit_create_tsv=1',
+        '--psm',
+        '6',
+        'txt',
+        'pdf',
+    ]
+
+
+@pytest.mark.skipif(
+    TESSERACT_VERSION[:2] < (3, 5), reason='requires tesseract >= 3.05',
+)
+def test_cache_encodes_once(monkeypatch, tmpdir, test_file):
+    prepared = []
+
+    def counting_prepare(image):
+        prepared.append(image)
+        return prepare(image)
+
+    monkeypatch.setattr('pytesseract.pytesseract.prepare', counting_prepare)
+    cache = OutputCache(directory=str(tmpdir))
+    with Image.open(test_file) as image:
+        image = image.convert('L')
+
+    for psm in 3, 6:
+        image_to_string(image, config='--psm {}'.format(psm), cache=cache)
+    image_to_string(
+        image, config='--psm 11', cache=cache, transport=Transport.PIPE
+    )
+    outputs = image_to_outputs(image, ('txt', 'tsv', 'box'), cache=cache)
+    assert 'The quick brown dog' in outputs['txt']
+    assert len(prepared) == 4
+    assert cache.stats()['misses'] == 6
+
+
 @pytest.mark.parametrize('extension', ['pdf', 'hocr'])
 def test_image_to_pdf_or_hocr(test_file, extension):
     result = image_to_pdf_or_hocr(test_file, extension=extension)
@@ -204,6 +785,119 @@ def test_image_to_pdf_or_hocr(test_file, extension):
         assert result.endswith('</html>')
 
 
+@pytest.mark.parametrize(
+    'transport', [Transport.FILE, Transport.PIPE], ids=['file', 'pipe'],
+)
+def test_image_to_pdf_or_hocr_structured(test_file, transport):
+    args = [test_file, None, '', 0, 'hocr']
+    result = image_to_pdf_or_hocr(
+        *args, output_type=Output.DICT, transport=transport
+    )
+    assert result['ocr_class'][0] == 'ocr_page'
+    assert result['parent'][0] == -1
+    assert set(result['page_num']) == {1}
+
+    words = [
+        index
+        for index, ocr_class in enumerate(result['ocr_class'])
+        if ocr_class == 'ocrx_word'
+    ]
+    assert result['text'][words[0]] == 'The'
+    assert all(result['conf'][index] >= 0 for index in words)
+    line = result['parent'][words[0]]
+    assert result['ocr_class'][line] == 'ocr_line'
+    assert len(result['baseline'][line]) == 2
+
+    elements = image_to_pdf_or_hocr(
+        *args, output_type=Output.ITER, transport=transport
+    )
+    assert [element.text for element in elements] == result['text']
+
+    with pytest.raises(ValueError):
+        image_to_pdf_or_hocr(test_file, output_type=Output.DICT)
+
+
+@pytest.mark.parametrize('extension', ['pdf', 'hocr'])
+def test_image_to_pdf_or_hocr_destination(
+    monkeypatch, tmpdir, test_file, extension,
+):
+    # pdfs differ by their creation date
+    expected = image_to_pdf_or_hocr(test_file, extension=extension)
+    if extension == 'pdf':
+        expected = expected[:8]
+
+    destination = tmpdir.join('output.' + extension)
+    destination.write('replaced')
+    args = [test_file, None, '', 0, extension]
+    assert image_to_pdf_or_hocr(*args, destination=str(destination)) is None
+    assert destination.read_binary().startswith(expected)
+    assert tmpdir.listdir() == [destination]
+
+    # a relative destination is written next to it, not to the temp dir
+    relative = tmpdir.mkdir('relative')
+    replaced = []
+
+    def replace(source, destination):
+        replaced.append(path.dirname(source))
+        rename(source, destination)
+
+    monkeypatch.setattr('pytesseract.pytesseract.replace', replace)
+    with relative.as_cwd():
+        image_to_pdf_or_hocr(*args, destination='output.' + extension)
+    assert replaced == [str(relative)]
+    assert (
+        relative.join('output.' + extension)
+        .read_binary()
+        .startswith(expected,)
+    )
+    assert len(relative.listdir()) == 1
+
+    stream = BytesIO()
+    image_to_pdf_or_hocr(*args, destination=stream, transport=Transport.PIPE)
+    assert stream.getvalue().startswith(expected)
+
+    stream = BytesIO()
+    FakeEngine.outputs[extension] = b'fake'
+    try:
+        image_to_pdf_or_hocr(*args, destination=stream, engine=FakeEngine())
+    finally:
+        del FakeEngine.outputs[extension]
+    assert stream.getvalue() == b'fake'
+
+
+def test_iter_hocr():
+    hocr = (
+        b'<?xml version="1.0" encoding="UTF-8"?>\n'
+        b'<html xmlns="http://www.w3.org/1999/xhtml"><body>'
+        b"<div class='ocr_page' id='page_1' title='bbox 0 0 640 480'>"
+        b"<span class='ocr_line' title='bbox 1 2 30 40; baseline 0.01 -3'>"
+        b"<span class='ocrx_word' title='bbox 1 2 10 12; x_wconf 96'>"
+        b'<strong>The</strong></span>'
+        b"<span class='ocrx_word'><span class='ocrx_cinfo'>a</span>"
+        b"<span class='ocrx_cinfo'>&amp;</span></span></span></div>"
+        b"<div class='ocr_page' title='bbox 0 0 10 10'></div></body></html>"
+    )
+    elements = list(iter_hocr(hocr))
+    chunks = [hocr[:100], hocr[100:101], hocr[101:]]
+    assert elements == list(iter_hocr(chunks))
+    assert [
+        (element.ocr_class, element.parent, element.page_num, element.text)
+        for element in elements
+    ] == [
+        ('ocr_page', -1, 1, ''),
+        ('ocr_line', 0, 1, ''),
+        ('ocrx_word', 1, 1, 'The'),
+        ('ocrx_word', 1, 1, 'a&'),
+        ('ocrx_cinfo', 3, 1, 'a'),
+        ('ocrx_cinfo', 3, 1, '&'),
+        ('ocr_page', -1, 2, ''),
+    ]
+    assert elements[1].baseline == (0.01, -3)
+    assert elements[2][4:8] == (1, 2, 9, 10)
+    assert elements[2].conf == 96
+    assert elements[3][4:] == (-1, -1, -1, -1, None, -1, 'a&')
+
+
 @pytest.mark.skipif(
     TESSERACT_VERSION[:2] >= (3, 5), reason='requires tesseract < 3.05',
 )
@@ -278,8 +972,7 @@ def test_image_to_data_common_output(test_file, output):
     elif output is Output.OBJECT:
         assert isinstance(result, Data)
         for line in result:
-            line.default_int = -2  # verifys that all values got set
-            line.default_str = '\t'  # to non default values Thanks python2
+            # verifys that all values got set to non default values
             assert isinstance(line, DataLine)
             assert line.level != line.default_int
             assert line.page_num != line.default_int
@@ -295,12 +988,319 @@ def test_image_to_data_common_output(test_file, output):
             assert line.text != line.default_str
 
 
+def test_file_to_dict():
+    tsv = (
+        'level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\t'
+        'left\ttop\twidth\theight\tconf\ttext\n'
+        '1\t1\t0\t0\t0\t0\t0\t0\t640\t480\t-1\t\n'
+        '5\t1\t1\t1\t1\t1\t36\t92\t60\t24\t96.583321\t42\n'
+        '5\t1\t1\t1\t1\t2\t100\t92\t60\t24\t-1'
+    )
+    result = file_to_dict(tsv, '\t', -1)
+    assert result['level'] == [1, 5, 5]
+    assert result['left'] == [0, 36, 100]
+    assert result['conf'] == [-1.0, 96.583321, -1.0]
+    assert result['text'] == ['', '42', '']
+
+    boxes = 'char left bottom right top page\n1 36 92 53 116 0\nT 5 6 7 8 0'
+    result = file_to_dict(boxes, ' ', 0)
+    assert result['char'] == ['1', 'T']
+    assert result['bottom'] == [92, 6]
+
+
+def test_data_object():
+    tsv = (
+        'level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\t'
+        'left\ttop\twidth\theight\tconf\ttext\n'
+        '1\t1\t0\t0\t0\t0\t0\t0\t640\t480\t-1\t\n'
+        '5\t1\t1\t1\t1\t1\t36\t92\t60\t24\t96.583321\tThe'
+    )
+    data = Data(tsv)
+    assert len(data) == 2
+    assert str(data) == tsv
+
+    line = data[1]
+    assert isinstance(line, DataLine)
+    assert (line.level, line.left, line.conf) == (5, 36, 96.583321)
+    assert isinstance(line.conf, float)
+    assert line.text == 'The'
+    assert str(line) == tsv.split('\n')[-1]
+    assert [line.level for line in data] == [1, 5]
+
+    # expected attributes missing from the headers have default values
+    line = DataLine('5\tThe', ['level', 'text'])
+    assert (line.level, line.text) == (5, 'The')
+    assert line.conf == line.default_int
+
+
+@pytest.mark.skipif(
+    TESSERACT_VERSION[:2] < (3, 5), reason='requires tesseract >= 3.05',
+)
+def test_image_to_data_cache(tmpdir, test_file):
+    cache = OutputCache(directory=str(tmpdir))
+    image = Image.open(test_file)
+    result = image_to_data(image, output_type=Output.DICT, cache=cache)
+    assert cache.stats()['misses'] == 1
+
+    assert image_to_data(image, output_type=Output.DICT, cache=cache) == result
+    assert isinstance(
+        image_to_data(image, output_type=Output.OBJECT, cache=cache), Data,
+    )
+    assert cache.stats()['memory_hits'] == 2
+
+    # a new cache finds the output in the directory
+    disk_cache = OutputCache(directory=str(tmpdir))
+    assert disk_cache.disk_size > 0
+    assert image_to_data(image, output_type=Output.DICT, cache=disk_cache) == (
+        result
+    )
+    assert disk_cache.stats()['disk_hits'] == 1
+
+    # a different config is a different result
+    image_to_data(image, config='--psm 6', cache=disk_cache)
+    assert disk_cache.stats()['misses'] == 1
+
+
+def test_output_cache_eviction(tmpdir):
+    cache = OutputCache(max_entries=1, directory=str(tmpdir), max_disk_size=5)
+    cache.set('first', b'abc')
+    tmpdir.join('first').setmtime(0)
+    cache.set('second', b'def')
+    assert cache.stats()['entries'] == 1
+    assert cache.disk_size == 3
+    assert tmpdir.listdir() == [tmpdir.join('second')]
+    assert cache.get('second') == b'def'
+    assert cache.get('first') is None
+
+    cache.clear()
+    assert cache.disk_size == 0
+    assert tmpdir.listdir() == []
+
+
+def test_output_cache_shared_directory(monkeypatch, tmpdir):
+    cache = OutputCache(directory=str(tmpdir), max_disk_size=5)
+    cache.set('first', b'abc')
+    cache.set('first', b'abc')
+    assert cache.disk_size == 3
+
+    # files removed by another process between listdir and the stat calls
+    monkeypatch.setattr(
+        'pytesseract.pytesseract.listdir',
+        lambda directory: listdir(directory) + ['removed'],
+    )
+    assert OutputCache(directory=str(tmpdir)).disk_size == 3
+    cache.set('second', b'def')
+    assert tmpdir.listdir() == [tmpdir.join('second')]
+    assert cache.disk_size == 3
+
+
+@pytest.mark.skipif(numpy_installed is False, reason='requires numpy')
+@pytest.mark.skipif(
+    TESSERACT_VERSION[:2] < (3, 5), reason='requires tesseract >= 3.05',
+)
+def test_image_to_data_numpy_output(test_file):
+    result = image_to_data(test_file, output_type=Output.NUMPY)
+    expected = image_to_data(test_file, output_type=Output.DICT)
+
+    assert isinstance(result, np.ndarray)
+    assert result['left'].dtype == np.int32
+    assert result['conf'].dtype == np.float64
+    for key in expected:
+        assert list(result[key]) == expected[key]
+
+
+@pytest.mark.skipif(
+    TESSERACT_VERSION[:2] < (3, 5), reason='requires tesseract >= 3.05',
+)
+@pytest.mark.parametrize(
+    'transport', [Transport.FILE, Transport.PIPE], ids=['file', 'pipe'],
+)
+def test_image_to_data_iter_output(test_file, transport):
+    expected = image_to_data(test_file, output_type=Output.DICT)
+    result = image_to_data(
+        test_file, output_type=Output.ITER, transport=transport,
+    )
+
+    assert not isinstance(result, list)
+    rows = list(result)
+    assert [row.text for row in rows] == expected['text']
+    assert [row.conf for row in rows] == expected['conf']
+    assert [row.left for row in rows] == expected['left']
+
+    words = image_to_data(
+        test_file, output_type=Output.ITER, transport=transport, level=5,
+    )
+    assert [row.text for row in words] == [
+        text
+        for text, level in zip(expected['text'], expected['level'])
+        if level == 5
+    ]
+
+
+@pytest.mark.skipif(numpy_installed is False, reason='requires numpy')
+def test_image_to_boxes_numpy_output(test_file):
+    result = image_to_boxes(test_file, output_type=Output.NUMPY)
+    assert isinstance(result, np.ndarray)
+    assert result['char'][0] == 'T'  # T of word 'This'
+    assert result['page'].dtype == np.int32
+
+
+def test_tracing(test_file):
+    traces = []
+    image = Image.open(test_file).convert('L')
+    with tracing(traces.append):
+        image_to_data(image, output_type=Output.DICT, transport=Transport.PIPE)
+    image_to_string(image)  # without hooks
+    assert len(traces) == 1
+
+    trace = traces[0]
+    assert isinstance(trace, Trace)
+    assert trace.function == 'image_to_data'
+    assert trace.extension == 'tsv'
+    assert {'prepare', 'encode', 'spawn', 'run', 'parse'} <= set(trace.stages)
+    assert trace.sizes['input_pixels'] == image.size[0] * image.size[1]
+    assert trace.sizes['encoded_bytes'] > 0
+    assert trace.sizes['output_bytes'] > 0
+    assert trace.duration >= sum(trace.stages.values())
+    assert trace.error is None
+
+
+def test_tracing_iter(test_file):
+    traces = []
+    with tracing(traces.append):
+        rows = image_to_data(test_file, output_type=Output.ITER)
+        assert traces == []
+        assert any(row.text == 'dog' for row in rows)
+        list(rows)
+    assert len(traces) == 1
+
+    trace = traces[0]
+    assert trace.function == 'image_to_data'
+    assert {'spawn', 'run'} <= set(trace.stages)
+    assert trace.error is None
+
+
+@pytest.mark.skipif(
+    platform.startswith('win32') or IS_PYTHON_2,
+    reason='requires os.wait4 and Popen._try_wait',
+)
+def test_usage_stats(monkeypatch, tmpdir, test_file):
+    stats = UsageStats()
+    monkeypatch.setattr('pytesseract.pytesseract.usage_stats', stats)
+    image_to_string(test_file)
+    usage = get_last_usage()
+    image_to_string(test_file, transport=Transport.PIPE)
+    image_to_boxes(test_file)
+
+    assert usage.user_time + usage.system_time > 0
+    assert usage.wall_time > 0
+    assert usage.max_rss > 0
+
+    dump = stats.dump()
+    assert [(entry['config'], entry['runs']) for entry in dump] == [
+        ('', 2),
+        (' batch.nochop makebox', 1),
+    ]
+    assert dump[0]['max_rss'] >= usage.max_rss
+    assert dump[0]['user_time'] >= usage.user_time
+
+    stats.clear()
+    assert stats.dump() == []
+
+    # outputs from the cache have no usage
+    cache = OutputCache(directory=str(tmpdir))
+    image_to_string(test_file, cache=cache)
+    assert get_last_usage() is not None
+    image_to_string(test_file, cache=cache)
+    assert get_last_usage() is None
+    image_to_outputs(test_file, ('txt',), cache=cache)
+    assert get_last_usage() is None
+
+
+@pytest.mark.skipif(
+    platform.startswith('win32'), reason='the stub is a Python script',
+)
+def test_benchmark_stub_tesseract(monkeypatch, test_file):
+    stub = path.join(
+        path.dirname(DATA_DIR), pardir, 'benchmarks', 'stub_tesseract.py',
+    )
+    monkeypatch.setattr('pytesseract.pytesseract.tesseract_cmd', stub)
+    monkeypatch.setenv('STUB_TESSERACT_WORDS', '25')
+
+    data = image_to_data(test_file, output_type=Output.DICT, cache=False)
+    assert data['text'].count('') == 6  # page, block, par and 3 lines
+    assert data['text'][-1] == 'word24'
+    assert image_to_string(test_file, cache=False).startswith('word0 word1')
+
+
+def test_import_does_not_load_numpy_or_pandas():
+    code = (
+        'import sys, pytesseract; '
+        'print(sorted({"numpy", "pandas"} & set(sys.modules)))'
+    )
+    assert check_output([executable, '-c', code]).strip() == b'[]'
+
+
 @pytest.mark.parametrize('obj', [1, 1.0, None], ids=['int', 'float', 'none'])
 def test_wrong_prepare_type(obj):
     with pytest.raises(TypeError):
         prepare(obj)
 
 
+@pytest.mark.parametrize('intermediate_format', ['PPM', 'PNG', 'TIFF', 'BMP'])
+def test_prepare_intermediate_format(monkeypatch, intermediate_format):
+    monkeypatch.setattr(
+        'pytesseract.pytesseract.intermediate_format', intermediate_format,
+    )
+    image, extension = prepare(Image.new('RGB', (10, 10)))
+    assert extension == intermediate_format
+    assert image.info['format'] == intermediate_format
+
+    # images with a source format keep it
+    image, extension = prepare(Image.open(TEST_JPEG))
+    assert extension == 'JPEG'
+
+
+@pytest.mark.parametrize(
+    'mode, expected_mode',
+    [
+        ('1', '1'),
+        ('L', 'L'),
+        ('LA', 'L'),
+        ('I;16', 'L'),
+        ('RGB', 'RGB'),
+        ('RGBA', 'RGB'),
+        ('P', 'RGB'),
+        ('CMYK', 'RGB'),
+    ],
+)
+def test_prepare_mode(mode, expected_mode):
+    image, _ = prepare(Image.new(mode, (10, 10)))
+    assert image.mode == expected_mode
+
+
+def test_prepare_alpha_and_16_bit():
+    # transparent pixels are flattened onto white
+    image, _ = prepare(Image.new('LA', (10, 10), (0, 0)))
+    assert image.getpixel((0, 0)) == 255
+
+    # 16 bit values are scaled down, not clipped
+    image, _ = prepare(Image.new('I;16', (10, 10), 32768))
+    assert image.getpixel((0, 0)) == 128
+
+
+def test_get_filename(test_file):
+    assert get_filename(test_file) == path.realpath(test_file)
+
+    image = Image.open(test_file)
+    assert get_filename(image) == path.realpath(test_file)
+
+    # loaded images might have been modified and get encoded again
+    image.load()
+    assert get_filename(image) is None
+    assert get_filename(Image.new('RGB', (10, 10))) is None
+
+
 @pytest.mark.parametrize(
     'test_path',
     [r'wrong_tesseract', getcwd() + path.sep + r'wrong_tesseract'],
@@ -316,6 +1316,10 @@ def test_wrong_tesseract_cmd(monkeypatch, test_file, test_path):
     with pytest.raises(TesseractNotFoundError):
         pytesseract.pytesseract.image_to_string(test_file)
 
+    # the version of the tesseract_cmd isn't the one of the previous command
+    with pytest.raises(TesseractNotFoundError):
+        get_tesseract_version()
+
 
 def test_main_not_found_cases(
     capsys, monkeypatch, test_file, test_invalid_file,